@@ -4,6 +4,7 @@ from flask_migrate import Migrate
 from datetime import datetime
 import os
 import locale
+import click
 from extensions import db, login_manager, migrate
 
 # Configurar el locale en español
@@ -19,19 +20,41 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-key-change-in-production')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///cafeteria.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Directorio compartido por los workers (sellos de versión, cachés en disco)
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR', os.path.join(app.instance_path, 'cache'))
+# Hilos que atienden peticiones en cada worker (gunicorn.conf.py, perfil hora_pico)
+app.config['HILOS_POR_WORKER'] = int(os.environ.get('HILOS_POR_WORKER', 1))
+# Escaneos confirmados desde un registro en disco e insertados por lotes (ver services/ingest.py)
+app.config['ASISTENCIA_DIFERIDA'] = os.environ.get('ASISTENCIA_DIFERIDA', '0') == '1'
+
+# Perfil del motor de base de datos (ver services/database.py)
+from services import database
+database.configurar(app)
 
 # Inicializar extensiones
 db.init_app(app)
+database.registrar_eventos(app, db)
 migrate.init_app(app, db)
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
 # Importar modelos después de inicializar db
-from models import Usuario, Estudiante, Asistencia, Menu, Configuracion
+from models import Estudiante, Asistencia, Menu, Configuracion
+from services import users
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Usuario.query.get(int(user_id))
+    # Caché por worker: evita una consulta en cada petición
+    return users.cargar(int(user_id))
+
+@app.cli.command('reconstruir-resumen')
+@click.option('--desde', type=click.DateTime(formats=['%Y-%m-%d']), help='Primera fecha a recalcular')
+@click.option('--hasta', type=click.DateTime(formats=['%Y-%m-%d']), help='Última fecha a recalcular')
+def reconstruir_resumen(desde, hasta):
+    """Recalcula resumen_asistencias desde la tabla de asistencias"""
+    from services import rollup
+    rollup.reconstruir(desde.date() if desde else None, hasta.date() if hasta else None)
+    print("Resumen de asistencias reconstruido")
 
 # Registrar blueprints
 from routes.auth import auth_bp
@@ -50,5 +73,9 @@ app.register_blueprint(menus_bp)
 app.register_blueprint(reports_bp)
 app.register_blueprint(admin_bp)
 
+# Límites de concurrencia por grupo de rutas (escaneo / reportes)
+from services import bulkhead
+bulkhead.init_app(app)
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
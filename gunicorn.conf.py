@@ -1,3 +1,44 @@
-workers = 4
+import os
+
+# GUNICORN_PERFIL=hora_pico: workers con hilos para escanear con mucha concurrencia
+perfil = os.environ.get('GUNICORN_PERFIL', 'sync')
+
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
 bind = "0.0.0.0:5000"
-timeout = 120 
\ No newline at end of file
+timeout = 120
+
+if perfil == 'hora_pico':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+    # Con rechazo rápido ninguna petición debería esperar mucho
+    timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+    keepalive = 5
+    # La aplicación dimensiona el pool de conexiones y los compartimentos con esto
+    os.environ.setdefault('HILOS_POR_WORKER', str(threads))
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+    os.environ.setdefault('DB_MAX_OVERFLOW', str(threads // 2))
+
+
+def post_worker_init(worker):
+    # Precargar el padrón, el índice de búsqueda y los servidos de hoy en cada worker antes de atender peticiones
+    from app import app
+    from services import database, ingest, roster, search, served
+    from services.attendance import momento_servicio
+    worker.log.info('Base de datos: %s', database.descripcion(app))
+    worker.log.info('Perfil de gunicorn: %s (%s hilos por worker)', perfil, app.config['HILOS_POR_WORKER'])
+    with app.app_context():
+        roster.precargar()
+        search.precargar()
+        served.precargar(momento_servicio()[0])
+        # Aplica los escaneos que dejó pendientes un worker anterior
+        if app.config['ASISTENCIA_DIFERIDA']:
+            ingest.iniciar()
+
+
+def worker_exit(server, worker):
+    # Vacía la cola de ingesta diferida antes de salir
+    from app import app
+    from services import ingest
+    if app.config['ASISTENCIA_DIFERIDA']:
+        with app.app_context():
+            ingest.detener()
\ No newline at end of file
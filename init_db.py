@@ -1,10 +1,23 @@
 from app import app, db
-from models import Usuario, Estudiante, Asistencia, Menu, Configuracion
+from models import Usuario, Estudiante, Asistencia, Menu, Configuracion, ResumenAsistencia
+from services import rollup
 
 def init_db():
     with app.app_context():
         # Crear todas las tablas
         db.create_all()
+
+        # create_all no modifica tablas existentes: crear los índices que falten
+        for index in Asistencia.__table__.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                print(f"No se pudo crear el índice {index.name}: {str(e)}")
+
+        # Bases existentes: calcular el resumen diario si todavía está vacío
+        if not ResumenAsistencia.query.first() and Asistencia.query.first():
+            rollup.reconstruir()
+            print("Resumen de asistencias calculado")
         
         # Verificar si ya existe un usuario administrador
         admin = Usuario.query.filter_by(email='admin@example.com').first()
@@ -1,6 +1,6 @@
 from extensions import db
 from flask_login import UserMixin
-from datetime import datetime
+from datetime import datetime, date
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class Usuario(UserMixin, db.Model):
@@ -44,11 +44,18 @@ class Estudiante(db.Model):
 
 class Asistencia(db.Model):
     __tablename__ = 'asistencias'
+    # Una sola comida de cada tipo por estudiante y día de servicio; el índice
+    # único también sirve las búsquedas de duplicados del escáner
+    __table_args__ = (
+        db.Index('uq_asistencias_estudiante_tipo_fecha', 'estudiante_id', 'tipo', 'fecha', unique=True),
+        # Orden del historial paginado por cursor y rangos de fechas
+        db.Index('ix_asistencias_fecha_hora_id', 'fecha', 'hora', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     estudiante_id = db.Column(db.Integer, db.ForeignKey('estudiantes.id'), nullable=False)
-    fecha = db.Column(db.Date, nullable=False, default=datetime.utcnow().date)
-    hora = db.Column(db.Time, nullable=False, default=datetime.utcnow().time)
+    fecha = db.Column(db.Date, nullable=False, default=date.today)
+    hora = db.Column(db.Time, nullable=False, default=lambda: datetime.now().time())
     tipo = db.Column(db.String(20), nullable=False, default='almuerzo')  # desayuno, almuerzo, cena
     metodo_registro = db.Column(db.String(20), default='manual')  # manual, QR, tarjeta
     registrado_por = db.Column(db.Integer, db.ForeignKey('usuarios.id'))
@@ -84,4 +91,35 @@ class Configuracion(db.Model):
     clave = db.Column(db.String(50), unique=True, nullable=False)
     valor = db.Column(db.String(200), nullable=False)
     descripcion = db.Column(db.String(200))
-    fecha_modificacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow) 
\ No newline at end of file
+    fecha_modificacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ClaveIdempotencia(db.Model):
+    __tablename__ = 'claves_idempotencia'
+    __table_args__ = (
+        db.UniqueConstraint('usuario_id', 'clave', name='uq_claves_idempotencia_usuario_clave'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    clave = db.Column(db.String(100), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
+    codigo = db.Column(db.Integer, nullable=False)  # Código HTTP de la respuesta original
+    respuesta = db.Column(db.Text, nullable=False)  # Cuerpo JSON de la respuesta original
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class ResumenAsistencia(db.Model):
+    __tablename__ = 'resumen_asistencias'
+    # Conteo diario de asistencias, se actualiza en la misma transacción que cada registro
+
+    fecha = db.Column(db.Date, primary_key=True)
+    tipo = db.Column(db.String(20), primary_key=True)
+    curso = db.Column(db.String(50), primary_key=True)
+    tipo_estudiante = db.Column(db.String(20), primary_key=True)
+    metodo_registro = db.Column(db.String(20), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+class Secuencia(db.Model):
+    __tablename__ = 'secuencias'
+    # Contadores con nombre; se reservan por bloques para generar identificadores sin colisiones
+
+    nombre = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Integer, nullable=False, default=0)  # Último número reservado
@@ -1,7 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from extensions import db
 from models import Usuario, Configuracion
+from services import jobs, memo, roster, settings, users
 from functools import wraps
 
 admin_bp = Blueprint('admin', __name__)
@@ -25,6 +26,13 @@ def dashboard():
                          total_usuarios=total_usuarios,
                          usuarios_activos=usuarios_activos)
 
+@admin_bp.route('/admin/cache')
+@login_required
+@admin_required
+def estadisticas_cache():
+    """Aciertos de la caché de consultas en el worker que atiende la petición"""
+    return jsonify(memo.estadisticas())
+
 @admin_bp.route('/admin/usuarios')
 @login_required
 @admin_required
@@ -48,6 +56,7 @@ def nuevo_usuario():
         try:
             db.session.add(usuario)
             db.session.commit()
+            users.invalidar()
             flash('Usuario creado exitosamente', 'success')
             return redirect(url_for('admin.lista_usuarios'))
         except:
@@ -73,6 +82,7 @@ def editar_usuario(id):
         
         try:
             db.session.commit()
+            users.invalidar()
             flash('Usuario actualizado exitosamente', 'success')
             return redirect(url_for('admin.lista_usuarios'))
         except:
@@ -86,58 +96,72 @@ def editar_usuario(id):
 @admin_required
 def configuracion():
     if request.method == 'POST':
-        # Actualizar configuraciones
-        for key, value in request.form.items():
-            if key.startswith('config_'):
-                config_key = key.replace('config_', '')
-                config = Configuracion.query.filter_by(clave=config_key).first()
-                if config:
-                    config.valor = value
-                else:
-                    config = Configuracion(clave=config_key, valor=value)
-                    db.session.add(config)
+        # Actualizar configuraciones en una sola sentencia
+        valores = {
+            key.replace('config_', '', 1): value
+            for key, value in request.form.items()
+            if key.startswith('config_')
+        }
         
         try:
-            db.session.commit()
+            settings.guardar(valores)
             flash('Configuración actualizada exitosamente', 'success')
+        except ValueError as e:
+            flash(str(e), 'error')
         except:
             db.session.rollback()
             flash('Error al actualizar la configuración', 'error')
     
     configuraciones = Configuracion.query.all()
     return render_template('admin/configuracion.html', 
-                         configuraciones=configuraciones)
+                         configuraciones=configuraciones,
+                         valores=settings.crudos())
 
 @admin_bp.route('/admin/horarios', methods=['GET', 'POST'])
 @login_required
 @admin_required
 def horarios():
+    claves = ['hora_inicio', 'hora_fin', 'dias_servicio',
+              'desayuno_inicio', 'desayuno_fin', 'almuerzo_inicio', 'almuerzo_fin',
+              'cena_inicio', 'cena_fin', 'horario_estricto']
     if request.method == 'POST':
-        # Actualizar horarios
-        horarios = {
-            'hora_inicio': request.form['hora_inicio'],
-            'hora_fin': request.form['hora_fin'],
-            'dias_servicio': request.form['dias_servicio']
-        }
-        
-        for key, value in horarios.items():
-            config = Configuracion.query.filter_by(clave=key).first()
-            if config:
-                config.valor = value
-            else:
-                config = Configuracion(clave=key, valor=value)
-                db.session.add(config)
+        # Actualizar horarios; las ventanas de comida son opcionales en el formulario
+        horarios = {key: request.form[key] for key in claves if key in request.form}
+        if 'hora_inicio' in request.form:
+            horarios['horario_estricto'] = '1' if request.form.get('horario_estricto') else '0'
         
         try:
-            db.session.commit()
+            settings.guardar(horarios)
             flash('Horarios actualizados exitosamente', 'success')
+        except ValueError as e:
+            flash(str(e), 'error')
         except:
             db.session.rollback()
             flash('Error al actualizar los horarios', 'error')
     
     configuraciones = Configuracion.query.filter(
-        Configuracion.clave.in_(['hora_inicio', 'hora_fin', 'dias_servicio'])
+        Configuracion.clave.in_(claves)
     ).all()
     
+    valores = settings.crudos()
     return render_template('admin/horarios.html', 
-                         configuraciones=configuraciones) 
\ No newline at end of file
+                         configuraciones=configuraciones,
+                         valores={key: valores[key] for key in claves}) 
+
+@admin_bp.route('/admin/carnets', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def carnets():
+    """Hoja de carnés con QR de un curso o de todo el colegio, generada en segundo plano"""
+    if request.method == 'POST':
+        curso = request.form.get('curso', '').strip()
+        try:
+            estado = jobs.enviar('carnets', **({'curso': curso} if curso else {}))
+            return redirect(url_for('admin.carnets', job=estado['id']))
+        except Exception as e:
+            flash(f'Error al generar los carnés: {str(e)}', 'error')
+    
+    cursos = sorted({e.curso for e in roster.todos() if e.estado})
+    return render_template('admin/carnets.html',
+                         cursos=cursos,
+                         job_id=request.args.get('job'))
\ No newline at end of file
@@ -1,15 +1,19 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from extensions import db
 from models import Estudiante, Asistencia
+from services.attendance import insertar_asistencia, momento_servicio, registrada, registrar_lote
+from services.idempotency import clave_valida, buscar_respuesta, guardar_respuesta
+from services.conditional import condicional
+from services import history, ingest, memo, roster, rollup, search, schedule as horario, served as servidos
 from datetime import datetime, date, time, timedelta
-from sqlalchemy import func, case
-import qrcode
-from io import BytesIO
-import base64
+from sqlalchemy.orm import contains_eager
 
 attendance_bp = Blueprint('attendance', __name__)
 
+MESES = ['Enero', 'Febrero', 'Marzo', 'Abril', 'Mayo', 'Junio', 'Julio',
+         'Agosto', 'Septiembre', 'Octubre', 'Noviembre', 'Diciembre']
+
 @attendance_bp.route('/asistencia')
 @login_required
 def index():
@@ -38,110 +42,147 @@ def registro_manual():
     return render_template('attendance/registrar.html',
                          ultimas_asistencias=ultimas_asistencias)
 
+def _filtros_estudiante():
+    """Filtros de curso y tipo de estudiante de la petición"""
+    return request.args.get('curso'), request.args.get('tipo_estudiante')
+
+def _filtrar_historial(query, fecha_inicio=None, fecha_fin=None, curso=None, tipo_estudiante=None):
+    """Aplica los filtros del historial; las fechas llegan como date"""
+    if fecha_inicio:
+        query = query.filter(Asistencia.fecha >= fecha_inicio)
+    if fecha_fin:
+        query = query.filter(Asistencia.fecha <= fecha_fin)
+    if curso:
+        query = query.filter(Estudiante.curso == curso)
+    if tipo_estudiante:
+        query = query.filter(Estudiante.tipo_estudiante == tipo_estudiante)
+    return query
+
+@memo.cacheado('asistencia.total_historial', tablas=('asistencias', 'estudiantes'))
+def _total_historial(fecha_inicio, fecha_fin, curso, tipo_estudiante):
+    return _filtrar_historial(
+        Asistencia.query.join(Estudiante), fecha_inicio, fecha_fin, curso, tipo_estudiante
+    ).count()
+
+def _limite_historial():
+    limite = request.args.get('limite', current_app.config.get('HISTORIAL_PAGINA', 50), type=int)
+    return max(1, min(limite, 500))
+
 @attendance_bp.route('/asistencia/historial')
 @login_required
 def historial():
     """Vista para el historial de asistencias"""
-    fecha_inicio = request.args.get('fecha_inicio', type=str)
-    fecha_fin = request.args.get('fecha_fin', type=str)
-    
-    query = Asistencia.query.join(Estudiante)
+    fecha_inicio = request.args.get('fecha_inicio', type=date.fromisoformat)
+    fecha_fin = request.args.get('fecha_fin', type=date.fromisoformat)
     
-    if fecha_inicio:
-        query = query.filter(Asistencia.fecha >= datetime.strptime(fecha_inicio, '%Y-%m-%d').date())
-    if fecha_fin:
-        query = query.filter(Asistencia.fecha <= datetime.strptime(fecha_fin, '%Y-%m-%d').date())
+    query = _filtrar_historial(
+        Asistencia.query.join(Estudiante).options(contains_eager(Asistencia.estudiante)),
+        fecha_inicio,
+        fecha_fin,
+        *_filtros_estudiante()
+    )
     
-    asistencias = query.order_by(Asistencia.fecha.desc()).all()
-    return render_template('attendance/historial.html', asistencias=asistencias)
+    try:
+        asistencias, siguiente_cursor = history.pagina(
+            query, request.args.get('cursor'), _limite_historial()
+        )
+    except ValueError:
+        asistencias, siguiente_cursor = history.pagina(query, None, _limite_historial())
+
+    filtros = {k: v for k, v in request.args.items() if k != 'cursor'}
+    cursos = sorted({estudiante.curso for estudiante in roster.todos()})
+    return render_template('attendance/historial.html',
+                         asistencias=asistencias,
+                         siguiente_cursor=siguiente_cursor,
+                         filtros=filtros,
+                         cursos=cursos)
 
-@attendance_bp.route('/estudiantes/<int:id>/qr')
+@attendance_bp.route('/asistencia/historial/total')
 @login_required
-def generar_qr(id):
-    estudiante = Estudiante.query.get_or_404(id)
-    
-    # Generar QR con la matrícula del estudiante
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(estudiante.matricula)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffered = BytesIO()
-    img.save(buffered, format="PNG")
-    qr_base64 = base64.b64encode(buffered.getvalue()).decode()
-    
-    return render_template('attendance/qr.html', 
-                         estudiante=estudiante, 
-                         qr_code=qr_base64)
+def historial_total():
+    """Total de registros del historial con los mismos filtros que la vista"""
+    try:
+        fecha_inicio = request.args.get('fecha_inicio', type=date.fromisoformat)
+        fecha_fin = request.args.get('fecha_fin', type=date.fromisoformat)
+        return jsonify({
+            'success': True,
+            'total': _total_historial(fecha_inicio, fecha_fin, *_filtros_estudiante())
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Error al calcular el total',
+            'error': str(e)
+        }), 400
 
 @attendance_bp.route('/resumen')
+@login_required
+@condicional('asistencias', 'resumen_asistencias')
 def resumen():
     # Obtener el mes y año actual si no se especifican
-    mes = request.args.get('mes', datetime.now().month)
-    anio = request.args.get('anio', datetime.now().year)
+    hoy = date.today()
+    mes = request.args.get('mes', hoy.month)
+    anio = request.args.get('anio', hoy.year)
+    
+    anios = list(range(hoy.year - 4, hoy.year + 1))
     
     try:
         mes = int(mes)
         anio = int(anio)
+        date(anio, mes, 1)
+        # Solo los años que ofrece el formulario; fuera de ellos, el mes actual
+        if anio not in anios:
+            raise ValueError(anio)
     except ValueError:
-        mes = datetime.now().month
-        anio = datetime.now().year
+        mes = hoy.month
+        anio = hoy.year
 
-    # Obtener estadísticas generales
-    total_asistencias = Asistencia.query.filter(
-        func.extract('month', Asistencia.hora) == mes,
-        func.extract('year', Asistencia.hora) == anio
-    ).count()
-
-    # Obtener asistencias por tipo de estudiante
-    asistencias_becados = db.session.query(func.count(Asistencia.id)).join(Estudiante).filter(
-        Estudiante.tipo_estudiante == 'becado',
-        func.extract('month', Asistencia.hora) == mes,
-        func.extract('year', Asistencia.hora) == anio
-    ).scalar()
-
-    asistencias_pagados = total_asistencias - (asistencias_becados or 0)
-
-    # Obtener asistencias por día
-    asistencias_por_dia = db.session.query(
-        func.date(Asistencia.hora).label('fecha'),
-        func.count(Asistencia.id).label('total')
-    ).filter(
-        func.extract('month', Asistencia.hora) == mes,
-        func.extract('year', Asistencia.hora) == anio
-    ).group_by(func.date(Asistencia.hora)).all()
-
-    # Obtener asistencias por curso
-    asistencias_por_curso = db.session.query(
-        Estudiante.curso,
-        func.count(Asistencia.id).label('total'),
-        func.sum(case([(Estudiante.tipo_estudiante == 'becado', 1)], else_=0)).label('becados'),
-        func.sum(case([(Estudiante.tipo_estudiante == 'pagado', 1)], else_=0)).label('pagados')
-    ).join(Estudiante).filter(
-        func.extract('month', Asistencia.hora) == mes,
-        func.extract('year', Asistencia.hora) == anio
-    ).group_by(Estudiante.curso).all()
+    # Un único recorrido del resumen diario; los meses cerrados quedan en caché
+    resumen_mes = rollup.resumen_mensual(anio, mes)
 
     return render_template('attendance/resumen.html',
-                         mes=mes,
-                         anio=anio,
-                         total_asistencias=total_asistencias,
-                         asistencias_becados=asistencias_becados,
-                         asistencias_pagados=asistencias_pagados,
-                         asistencias_por_dia=asistencias_por_dia,
-                         asistencias_por_curso=asistencias_por_curso)
+                         mes_actual=mes,
+                         anio_actual=anio,
+                         meses=list(enumerate(MESES, start=1)),
+                         anios=anios,
+                         **resumen_mes)
 
 @attendance_bp.route('/api/asistencias/registrar', methods=['POST'])
 @login_required
 def api_registrar_asistencia():
     """API endpoint para registrar asistencia"""
     try:
+        # Un reintento con la misma clave devuelve la respuesta original
+        clave = request.headers.get('Idempotency-Key', '').strip()
+        if clave:
+            if not clave_valida(clave):
+                return jsonify({
+                    'success': False,
+                    'message': 'Idempotency-Key no válida'
+                }), 400
+            respuesta_previa = buscar_respuesta(clave, current_user.id)
+            if respuesta_previa is not None:
+                return respuesta_previa
+
         data = request.json
         estudiante_id = data['estudiante_id']
-        tipo = data['tipo']
 
-        # Verificar si el estudiante existe
-        estudiante = Estudiante.query.get_or_404(estudiante_id)
+        # La comida la decide el horario; fuera de horario no se consulta nada más
+        fecha, hora = momento_servicio()
+        tipo, error = horario.resolver(data.get('tipo'), fecha, hora)
+        if error:
+            return jsonify({
+                'success': False,
+                'message': error
+            }), 400
+
+        # Verificar si el estudiante existe (padrón en memoria, sin consulta)
+        estudiante = roster.obtener(estudiante_id)
+        if estudiante is None:
+            return jsonify({
+                'success': False,
+                'message': 'Estudiante no encontrado'
+            }), 404
         
         # Verificar si el estudiante está activo
         if not estudiante.estado:
@@ -150,36 +191,74 @@ def api_registrar_asistencia():
                 'message': 'El estudiante no está activo'
             }), 400
 
-        # Verificar si ya existe un registro para este tipo de comida hoy
-        hoy = datetime.utcnow().date()
-        registro_existente = Asistencia.query.filter(
-            Asistencia.estudiante_id == estudiante_id,
-            Asistencia.tipo == tipo,
-            db.func.date(Asistencia.fecha) == hoy
-        ).first()
-
-        if registro_existente:
+        # Duplicado ya conocido por este worker: se rechaza sin consultar la base de datos
+        if servidos.ya_servido(estudiante.id, tipo, fecha):
             return jsonify({
                 'success': False,
                 'message': f'Ya existe un registro de {tipo} para este estudiante hoy'
             }), 400
 
-        # Crear nuevo registro de asistencia
-        asistencia = Asistencia(
-            estudiante_id=estudiante_id,
-            tipo=tipo,
-            registrado_por=current_user.id
-        )
-        db.session.add(asistencia)
-        db.session.commit()
-
-        return jsonify({
+        cuerpo = {
             'success': True,
             'message': 'Asistencia registrada exitosamente',
             'estudiante_nombre': estudiante.nombre,
             'tipo': tipo,
-            'fecha': asistencia.fecha.isoformat()
-        })
+            'fecha': fecha.isoformat()
+        }
+
+        # Ingesta diferida: el registro en disco confirma el escaneo y el insert va en el próximo lote
+        if ingest.activa():
+            # Otro worker pudo servirla: se mira la base y la reserva compartida
+            if registrada(estudiante.id, tipo, fecha) or not ingest.reservar(estudiante.id, tipo, fecha):
+                servidos.marcar_servido(estudiante.id, tipo, fecha)
+                return jsonify({
+                    'success': False,
+                    'message': f'Ya existe un registro de {tipo} para este estudiante hoy'
+                }), 400
+            try:
+                ingest.encolar({
+                    'estudiante_id': estudiante.id,
+                    'tipo': tipo,
+                    'fecha': fecha,
+                    'hora': hora,
+                    'metodo_registro': 'manual',
+                    'registrado_por': current_user.id,
+                    'observaciones': None
+                }, clave=clave or None, usuario_id=current_user.id, cuerpo=cuerpo)
+            except Exception:
+                ingest.liberar(estudiante.id, tipo, fecha)
+                raise
+            servidos.marcar_servido(estudiante.id, tipo, fecha)
+            return jsonify(cuerpo)
+
+        # Insertar o detectar el duplicado en una sola sentencia
+        asistencia_id = insertar_asistencia(
+            estudiante.id,
+            tipo,
+            registrado_por=current_user.id,
+            fecha=fecha,
+            hora=hora
+        )
+
+        if asistencia_id is None:
+            db.session.rollback()
+            servidos.marcar_servido(estudiante.id, tipo, fecha)
+            # Una petición concurrente con la misma clave pudo registrarla
+            if clave:
+                respuesta_previa = buscar_respuesta(clave, current_user.id)
+                if respuesta_previa is not None:
+                    return respuesta_previa
+            return jsonify({
+                'success': False,
+                'message': f'Ya existe un registro de {tipo} para este estudiante hoy'
+            }), 400
+
+        if clave:
+            guardar_respuesta(clave, current_user.id, cuerpo)
+        db.session.commit()
+        servidos.marcar_servido(estudiante.id, tipo, fecha)
+
+        return jsonify(cuerpo)
 
     except Exception as e:
         db.session.rollback()
@@ -189,6 +268,64 @@ def api_registrar_asistencia():
             'error': str(e)
         }), 400
 
+@attendance_bp.route('/api/asistencias/registrar-lote', methods=['POST'])
+@login_required
+def api_registrar_lote():
+    """API endpoint para registrar un lote de asistencias en una transacción"""
+    try:
+        clave = request.headers.get('Idempotency-Key', '').strip()
+        if clave:
+            if not clave_valida(clave):
+                return jsonify({
+                    'success': False,
+                    'message': 'Idempotency-Key no válida'
+                }), 400
+            respuesta_previa = buscar_respuesta(clave, current_user.id)
+            if respuesta_previa is not None:
+                return respuesta_previa
+
+        data = request.json
+        items = data.get('asistencias') if isinstance(data, dict) else data
+        limite = current_app.config.get('ASISTENCIA_LOTE_MAX', 500)
+
+        if not isinstance(items, list) or not items:
+            return jsonify({
+                'success': False,
+                'message': 'Se requiere una lista de asistencias'
+            }), 400
+        if len(items) > limite:
+            return jsonify({
+                'success': False,
+                'message': f'El lote no puede superar {limite} registros'
+            }), 400
+
+        resultados = registrar_lote(items, registrado_por=current_user.id)
+        cuerpo = {
+            'success': True,
+            'registrados': sum(1 for r in resultados if r['success']),
+            'resultados': resultados
+        }
+        if clave:
+            guardar_respuesta(clave, current_user.id, cuerpo)
+        db.session.commit()
+        for resultado in resultados:
+            if resultado['success']:
+                servidos.marcar_servido(
+                    resultado['estudiante_id'],
+                    resultado['tipo'],
+                    date.fromisoformat(resultado['fecha'])
+                )
+
+        return jsonify(cuerpo)
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'message': 'Error al registrar el lote de asistencias',
+            'error': str(e)
+        }), 400
+
 @attendance_bp.route('/api/asistencias/buscar', methods=['POST'])
 @login_required
 def api_buscar_estudiante():
@@ -204,24 +341,25 @@ def api_buscar_estudiante():
                 'message': 'El valor de búsqueda es requerido'
             }), 400
 
-        query = Estudiante.query
-
-        if tipo == 'identificador':
-            query = query.filter(Estudiante.identificador.ilike(f'%{valor}%'))
-        elif tipo == 'nombre':
-            query = query.filter(Estudiante.nombre.ilike(f'%{valor}%'))
-        elif tipo == 'grado':
-            query = query.filter(Estudiante.grado.ilike(f'%{valor}%'))
-        else:
+        # El formulario antiguo enviaba 'grado'; la columna es 'curso'
+        if tipo == 'grado':
+            tipo = 'curso'
+        if tipo not in search.CAMPOS:
             return jsonify({
                 'success': False,
                 'message': 'Tipo de búsqueda no válido'
             }), 400
 
-        estudiantes = query.filter_by(estado=True).all()
+        estudiantes, siguiente_cursor = search.buscar(
+            valor,
+            tipo,
+            limite=int(data.get('limite') or current_app.config.get('BUSQUEDA_LIMITE', 20)),
+            cursor=data.get('cursor')
+        )
         return jsonify({
             'success': True,
-            'estudiantes': [estudiante.to_dict() for estudiante in estudiantes]
+            'estudiantes': [estudiante._asdict() for estudiante in estudiantes],
+            'siguiente_cursor': siguiente_cursor
         })
 
     except Exception as e:
@@ -234,19 +372,28 @@ def api_buscar_estudiante():
 @attendance_bp.route('/api/asistencias/historial', methods=['GET'])
 @login_required
 def api_obtener_historial():
-    """API endpoint para obtener historial de asistencias"""
+    """API endpoint para obtener historial de asistencias, paginado por cursor"""
     try:
-        fecha_inicio = request.args.get('fecha_inicio', default=datetime.utcnow().date().isoformat())
-        fecha_fin = request.args.get('fecha_fin', default=datetime.utcnow().date().isoformat())
+        hoy = date.today()
+        fecha_inicio = request.args.get('fecha_inicio', default=hoy, type=date.fromisoformat)
+        fecha_fin = request.args.get('fecha_fin', default=hoy, type=date.fromisoformat)
         
-        asistencias = Asistencia.query.filter(
-            db.func.date(Asistencia.fecha).between(fecha_inicio, fecha_fin)
-        ).order_by(Asistencia.fecha.desc()).all()
+        query = _filtrar_historial(
+            Asistencia.query.join(Estudiante), fecha_inicio, fecha_fin, *_filtros_estudiante()
+        )
+        asistencias, siguiente_cursor = history.pagina(
+            query, request.args.get('cursor'), _limite_historial()
+        )
 
-        return jsonify({
+        respuesta = {
             'success': True,
-            'asistencias': [asistencia.to_dict() for asistencia in asistencias]
-        })
+            'asistencias': [asistencia.to_dict() for asistencia in asistencias],
+            'siguiente_cursor': siguiente_cursor
+        }
+        # El total solo se calcula si se pide
+        if request.args.get('incluir_total', type=int):
+            respuesta['total'] = _total_historial(fecha_inicio, fecha_fin, *_filtros_estudiante())
+        return jsonify(respuesta)
 
     except Exception as e:
         return jsonify({
@@ -265,7 +412,7 @@ def registrar_asistencia():
         observaciones = request.form.get('observaciones', '')
 
         # Buscar estudiante por identificador
-        estudiante = Estudiante.query.filter_by(identificador=identificador).first()
+        estudiante = roster.obtener(identificador)
         if not estudiante:
             flash('Estudiante no encontrado', 'error')
             return redirect(url_for('attendance.registro_manual'))
@@ -275,28 +422,30 @@ def registrar_asistencia():
             flash('El estudiante no está activo', 'error')
             return redirect(url_for('attendance.registro_manual'))
 
-        # Verificar si ya existe un registro para este tipo de comida hoy
-        hoy = datetime.utcnow().date()
-        registro_existente = Asistencia.query.filter(
-            Asistencia.estudiante_id == estudiante.id,
-            Asistencia.tipo == tipo,
-            db.func.date(Asistencia.fecha) == hoy
-        ).first()
-
-        if registro_existente:
+        fecha, hora = momento_servicio()
+        if servidos.ya_servido(estudiante.id, tipo, fecha):
             flash(f'Ya existe un registro de {tipo} para este estudiante hoy', 'warning')
             return redirect(url_for('attendance.registro_manual'))
 
-        # Crear nuevo registro de asistencia
-        asistencia = Asistencia(
-            estudiante_id=estudiante.id,
-            tipo=tipo,
-            metodo_registro='manual',
+        # Insertar o detectar el duplicado en una sola sentencia
+        asistencia_id = insertar_asistencia(
+            estudiante.id,
+            tipo,
             registrado_por=current_user.id,
-            observaciones=observaciones
+            metodo_registro='manual',
+            observaciones=observaciones,
+            fecha=fecha,
+            hora=hora
         )
-        db.session.add(asistencia)
+
+        if asistencia_id is None:
+            db.session.rollback()
+            servidos.marcar_servido(estudiante.id, tipo, fecha)
+            flash(f'Ya existe un registro de {tipo} para este estudiante hoy', 'warning')
+            return redirect(url_for('attendance.registro_manual'))
+
         db.session.commit()
+        servidos.marcar_servido(estudiante.id, tipo, fecha)
 
         flash(f'Asistencia registrada exitosamente para {estudiante.nombre}', 'success')
         return redirect(url_for('attendance.registro_manual'))
@@ -1,22 +1,21 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, render_template, Response, current_app, stream_with_context
 from flask_login import login_required
-from models import Estudiante, Asistencia, Menu
+from extensions import db
+from models import Estudiante, Asistencia, Menu, ResumenAsistencia
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, cast, Date
+from services import live, memo
+from services.conditional import condicional
+from sqlalchemy import func
 
 main_bp = Blueprint('main', __name__)
 
-@main_bp.route('/')
-@login_required
-def index():
-    # Fecha actual
-    hoy = date.today()
-    current_date = datetime.now()  # Para mostrar la fecha completa con nombre del día
-    
-    # Estadísticas generales
-    asistencias_hoy = Asistencia.query.filter(
-        cast(Asistencia.fecha, Date) == hoy
-    ).count()
+@memo.cacheado('inicio.estadisticas', tablas=('resumen_asistencias', 'estudiantes', 'menus'))
+def _estadisticas(hoy):
+    """Contadores y serie semanal de la página de inicio"""
+    # Estadísticas generales (las asistencias salen del resumen diario)
+    asistencias_hoy = db.session.query(
+        func.coalesce(func.sum(ResumenAsistencia.total), 0)
+    ).filter(ResumenAsistencia.fecha == hoy).scalar()
     
     total_estudiantes = Estudiante.query.count()
     estudiantes_becados = Estudiante.query.filter_by(tipo_estudiante='becado', estado=True).count()
@@ -25,13 +24,13 @@ def index():
 
     # Datos para el gráfico de asistencias (últimos 7 días)
     fecha_inicio = hoy - timedelta(days=6)
-    asistencias_semana = Asistencia.query.filter(
-        Asistencia.fecha >= fecha_inicio,
-        Asistencia.fecha <= hoy
-    ).with_entities(
-        Asistencia.fecha,
-        func.count(Asistencia.id).label('total')
-    ).group_by(Asistencia.fecha).all()
+    asistencias_semana = db.session.query(
+        ResumenAsistencia.fecha,
+        func.sum(ResumenAsistencia.total).label('total')
+    ).filter(
+        ResumenAsistencia.fecha >= fecha_inicio,
+        ResumenAsistencia.fecha <= hoy
+    ).group_by(ResumenAsistencia.fecha).all()
 
     # Preparar datos para el gráfico
     dias = []
@@ -51,6 +50,27 @@ def index():
         dias.append(fecha.strftime('%d/%m'))
         asistencias_por_dia.append(asistencias_dict[fecha])
 
+    return {
+        'asistencias_hoy': asistencias_hoy,
+        'total_estudiantes': total_estudiantes,
+        'estudiantes_becados': estudiantes_becados,
+        'estudiantes_pagados': estudiantes_pagados,
+        'menus_activos': menus_activos,
+        'dias': dias,
+        'asistencias_por_dia': asistencias_por_dia
+    }
+
+@main_bp.route('/')
+@login_required
+@condicional('asistencias', 'resumen_asistencias', 'estudiantes', 'menus')
+def index():
+    # Fecha actual
+    hoy = date.today()
+    current_date = datetime.now()  # Para mostrar la fecha completa con nombre del día
+
+    # Contadores compartidos entre usuarios mientras no cambien las tablas
+    estadisticas = _estadisticas(hoy)
+
     # Últimas asistencias
     ultimas_asistencias = Asistencia.query.join(Estudiante).order_by(
         Asistencia.fecha.desc(),
@@ -62,12 +82,23 @@ def index():
 
     return render_template('main/index.html',
                          current_date=current_date,
-                         asistencias_hoy=asistencias_hoy,
-                         total_estudiantes=total_estudiantes,
-                         estudiantes_becados=estudiantes_becados,
-                         estudiantes_pagados=estudiantes_pagados,
-                         menus_activos=menus_activos,
-                         dias=dias,
-                         asistencias_por_dia=asistencias_por_dia,
                          ultimas_asistencias=ultimas_asistencias,
-                         menu_hoy=menu_hoy) 
\ No newline at end of file
+                         menu_hoy=menu_hoy,
+                         **estadisticas)
+
+@main_bp.route('/en-vivo')
+@login_required
+def en_vivo():
+    """Stream de eventos con los contadores del día"""
+    # stream_with_context mantiene el compartimento ocupado mientras dure la conexión
+    flujo = live.flujo(current_app.config.get('EN_VIVO_DURACION', 600))
+    respuesta = Response(stream_with_context(flujo), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+@main_bp.route('/api/en-vivo')
+@login_required
+def api_en_vivo():
+    """Contadores del día para los navegadores que no mantienen el stream"""
+    return Response(live.actuales(), mimetype='application/json')
\ No newline at end of file
@@ -1,40 +1,35 @@
-from flask import Blueprint, render_template, request, send_file
-from flask_login import login_required
+from flask import Blueprint, render_template, request, send_file, Response, stream_with_context, jsonify, url_for, abort, redirect
+from flask_login import login_required, current_user
 from extensions import db
-from models import Estudiante, Asistencia, Menu
+from models import Estudiante, Asistencia, Menu, ResumenAsistencia
+from services import exports, jobs, memo
+from services.conditional import condicional
 from datetime import datetime, date, timedelta
 from sqlalchemy import func
-import pandas as pd
-from io import BytesIO
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
 
 reports_bp = Blueprint('reports', __name__)
 
-@reports_bp.route('/reportes')
-@login_required
-def dashboard():
+@memo.cacheado('reportes.dashboard', tablas=('resumen_asistencias', 'estudiantes'))
+def _estadisticas_dashboard(hoy):
+    """Todo lo que muestra el dashboard de reportes"""
     # Estadísticas generales
     total_estudiantes = Estudiante.query.count()
     estudiantes_activos = Estudiante.query.filter_by(estado=True).count()
     
-    # Asistencias de hoy
-    hoy = date.today()
-    asistencias_hoy = Asistencia.query.filter(
-        func.date(Asistencia.fecha) == hoy
-    ).count()
+    # Asistencias de hoy (desde el resumen diario)
+    asistencias_hoy = db.session.query(
+        func.coalesce(func.sum(ResumenAsistencia.total), 0)
+    ).filter(ResumenAsistencia.fecha == hoy).scalar()
     
     # Asistencias por tipo de estudiante (última semana)
-    fecha_inicio = date.today() - timedelta(days=7)
+    fecha_inicio = hoy - timedelta(days=7)
     asistencias_por_tipo = db.session.query(
-        Estudiante.tipo_estudiante,
-        func.count(Asistencia.id).label('total')
-    ).join(Asistencia).filter(
-        func.date(Asistencia.fecha) >= fecha_inicio,
-        func.date(Asistencia.fecha) <= hoy
-    ).group_by(Estudiante.tipo_estudiante).all()
+        ResumenAsistencia.tipo_estudiante,
+        func.sum(ResumenAsistencia.total).label('total')
+    ).filter(
+        ResumenAsistencia.fecha >= fecha_inicio,
+        ResumenAsistencia.fecha <= hoy
+    ).group_by(ResumenAsistencia.tipo_estudiante).all()
 
     # Asegurar que tenemos ambos tipos de estudiantes en los resultados
     tipos_dict = dict(asistencias_por_tipo)
@@ -45,12 +40,12 @@ def dashboard():
 
     # Asistencias por día (última semana)
     asistencias_semana = db.session.query(
-        func.date(Asistencia.fecha).label('fecha'),
-        func.count(Asistencia.id).label('total')
+        ResumenAsistencia.fecha,
+        func.sum(ResumenAsistencia.total).label('total')
     ).filter(
-        func.date(Asistencia.fecha) >= fecha_inicio,
-        func.date(Asistencia.fecha) <= hoy
-    ).group_by(func.date(Asistencia.fecha)).all()
+        ResumenAsistencia.fecha >= fecha_inicio,
+        ResumenAsistencia.fecha <= hoy
+    ).group_by(ResumenAsistencia.fecha).all()
 
     # Preparar datos para el gráfico con todos los días
     dias = []
@@ -68,22 +63,26 @@ def dashboard():
     # Calcular porcentaje de asistencia diaria de manera segura
     porcentaje_asistencia = round((asistencias_hoy / estudiantes_activos * 100) if estudiantes_activos > 0 else 0)
     
-    return render_template('reports/dashboard.html',
-                         total_estudiantes=total_estudiantes,
-                         estudiantes_activos=estudiantes_activos,
-                         asistencias_hoy=asistencias_hoy,
-                         asistencias_por_tipo=asistencias_por_tipo,
-                         dias=dias,
-                         totales=totales,
-                         porcentaje_asistencia=porcentaje_asistencia)
+    return {
+        'total_estudiantes': total_estudiantes,
+        'estudiantes_activos': estudiantes_activos,
+        'asistencias_hoy': asistencias_hoy,
+        'asistencias_por_tipo': asistencias_por_tipo,
+        'dias': dias,
+        'totales': totales,
+        'porcentaje_asistencia': porcentaje_asistencia
+    }
 
-@reports_bp.route('/reportes/asistencia')
+@reports_bp.route('/reportes')
 @login_required
-def reporte_asistencia():
-    fecha_inicio = request.args.get('fecha_inicio', type=date.fromisoformat)
-    fecha_fin = request.args.get('fecha_fin', type=date.fromisoformat)
-    tipo_estudiante = request.args.get('tipo_estudiante')
-    
+@condicional('asistencias', 'resumen_asistencias', 'estudiantes')
+def dashboard():
+    # Mismos datos para todo el personal mientras no cambien las tablas
+    return render_template('reports/dashboard.html', **_estadisticas_dashboard(date.today()))
+
+@memo.cacheado('reportes.asistencia', tablas=('asistencias', 'estudiantes'))
+def _reporte_asistencia(fecha_inicio, fecha_fin, tipo_estudiante):
+    """Asistencias por estudiante, como diccionarios para poder guardarlas en la caché"""
     query = db.session.query(
         Estudiante.nombre,
         Estudiante.identificador,
@@ -106,6 +105,16 @@ def reporte_asistencia():
         Estudiante.curso,
         Estudiante.tipo_estudiante
     ).all()
+    return [fila._asdict() for fila in resultados]
+
+@reports_bp.route('/reportes/asistencia')
+@login_required
+@condicional('asistencias', 'estudiantes')
+def reporte_asistencia():
+    fecha_inicio = request.args.get('fecha_inicio', type=date.fromisoformat)
+    fecha_fin = request.args.get('fecha_fin', type=date.fromisoformat)
+    tipo_estudiante = request.args.get('tipo_estudiante')
+    resultados = _reporte_asistencia(fecha_inicio, fecha_fin, tipo_estudiante)
     
     return render_template('reports/asistencia.html',
                          resultados=resultados,
@@ -113,111 +122,130 @@ def reporte_asistencia():
                          fecha_fin=fecha_fin,
                          tipo_estudiante=tipo_estudiante)
 
+def _exportar(formato, **parametros):
+    """Encola la exportación con las fechas de la petición.
+
+    Si el archivo ya está listo se descarga de inmediato; si no, una página
+    consulta el progreso y lo descarga al terminar, sin ocupar el worker.
+    """
+    for clave in ('fecha_inicio', 'fecha_fin'):
+        valor = request.args.get(clave, type=date.fromisoformat)
+        if valor:
+            parametros[clave] = valor.isoformat()
+
+    estado = jobs.enviar(formato, **parametros)
+    if estado['estado'] == jobs.LISTO:
+        return redirect(url_for('reports.descargar_exportacion', job_id=estado['id']))
+    return render_template('reports/exportacion.html',
+                         job_id=estado['id'],
+                         formato=formato,
+                         volver=request.referrer or url_for('reports.dashboard'))
+
 @reports_bp.route('/reportes/exportar/csv')
 @login_required
 def exportar_csv():
+    comprimir = request.args.get('gzip', type=int) == 1
+    # segundo_plano=1 lo deja como trabajo, igual que PDF y Excel
+    if request.args.get('segundo_plano', type=int) == 1:
+        return _exportar('csv', comprimir=True) if comprimir else _exportar('csv')
+
     fecha_inicio = request.args.get('fecha_inicio', type=date.fromisoformat)
     fecha_fin = request.args.get('fecha_fin', type=date.fromisoformat)
     
-    query = db.session.query(
-        Estudiante.nombre,
-        Estudiante.identificador,
-        Estudiante.curso,
-        Estudiante.tipo_estudiante,
-        Asistencia.fecha,
-        Asistencia.hora,
-        Asistencia.metodo_registro
-    ).join(Asistencia)
+    # El CSV se envía a medida que se leen las filas, sin cargarlo en memoria
+    nombre = f'asistencias_{date.today()}.csv'
+    if comprimir:
+        nombre += '.gz'
     
-    if fecha_inicio:
-        query = query.filter(Asistencia.fecha >= fecha_inicio)
-    if fecha_fin:
-        query = query.filter(Asistencia.fecha <= fecha_fin)
-    
-    resultados = query.order_by(Asistencia.fecha.desc()).all()
-    
-    # Crear DataFrame
-    df = pd.DataFrame(resultados, columns=[
-        'Nombre', 'Identificador', 'Curso', 'Tipo de Estudiante', 'Fecha', 'Hora', 'Método'
-    ])
-    
-    # Exportar a CSV
-    output = BytesIO()
-    df.to_csv(output, index=False, encoding='utf-8-sig')
-    output.seek(0)
-    
-    return send_file(
-        output,
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'asistencias_{date.today()}.csv'
+    return Response(
+        stream_with_context(exports.generar_csv(fecha_inicio, fecha_fin, comprimir)),
+        mimetype='application/gzip' if comprimir else 'text/csv; charset=utf-8',
+        headers={'Content-Disposition': f'attachment; filename={nombre}'}
     )
 
+@reports_bp.route('/reportes/exportar/xlsx')
+@login_required
+def exportar_xlsx():
+    return _exportar('xlsx')
+
 @reports_bp.route('/reportes/exportar/pdf')
 @login_required
 def exportar_pdf():
-    fecha_inicio = request.args.get('fecha_inicio', type=date.fromisoformat)
-    fecha_fin = request.args.get('fecha_fin', type=date.fromisoformat)
-    
-    # Obtener datos
-    query = db.session.query(
-        Estudiante.nombre,
-        Estudiante.identificador,
-        Estudiante.curso,
-        Estudiante.tipo_estudiante,
-        db.func.count(Asistencia.id).label('total_asistencias')
-    ).join(Asistencia)
-    
-    if fecha_inicio:
-        query = query.filter(Asistencia.fecha >= fecha_inicio)
-    if fecha_fin:
-        query = query.filter(Asistencia.fecha <= fecha_fin)
-    
-    resultados = query.group_by(
-        Estudiante.id,
-        Estudiante.nombre,
-        Estudiante.identificador,
-        Estudiante.curso,
-        Estudiante.tipo_estudiante
-    ).all()
-    
-    # Crear PDF
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    elements.append(Paragraph("Reporte de Asistencias", styles['Title']))
-    elements.append(Paragraph(f"Período: {fecha_inicio} a {fecha_fin}", styles['Normal']))
-    
-    # Tabla de datos
-    data = [['Nombre', 'Identificador', 'Curso', 'Tipo', 'Total Asistencias']]
-    for r in resultados:
-        data.append([r.nombre, r.identificador, r.curso, r.tipo_estudiante, str(r.total_asistencias)])
-    
-    table = Table(data)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 14),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 12),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black)
-    ]))
-    
-    elements.append(table)
-    doc.build(elements)
-    
-    buffer.seek(0)
+    return _exportar('pdf')
+
+@reports_bp.route('/reportes/exportaciones', methods=['POST'])
+@login_required
+def crear_exportacion():
+    """Encola una exportación pesada y devuelve su id de inmediato"""
+    try:
+        data = request.get_json(silent=True) or request.form
+        formato = data.get('formato', 'csv')
+        if formato not in jobs.FORMATOS:
+            return jsonify({
+                'success': False,
+                'message': 'Formato de exportación no válido'
+            }), 400
+        if formato in jobs.FORMATOS_ADMIN and current_user.rol != 'admin':
+            return jsonify({
+                'success': False,
+                'message': 'Se requieren privilegios de administrador'
+            }), 403
+
+        parametros = {}
+        for clave in ('fecha_inicio', 'fecha_fin'):
+            if data.get(clave):
+                parametros[clave] = date.fromisoformat(data[clave]).isoformat()
+        if formato == 'csv' and str(data.get('gzip', '')) in ('1', 'true'):
+            parametros['comprimir'] = True
+
+        estado = jobs.enviar(formato, **parametros)
+        return jsonify(_respuesta_exportacion(estado)), 202
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': 'Error al crear la exportación',
+            'error': str(e)
+        }), 400
+
+@reports_bp.route('/reportes/exportaciones/<job_id>')
+@login_required
+def estado_exportacion(job_id):
+    """Estado y progreso de una exportación"""
+    estado = jobs.obtener(job_id)
+    if estado is None:
+        return jsonify({
+            'success': False,
+            'message': 'Exportación no encontrada o expirada'
+        }), 404
+    return jsonify(_respuesta_exportacion(estado))
+
+@reports_bp.route('/reportes/exportaciones/<job_id>/descargar')
+@login_required
+def descargar_exportacion(job_id):
+    estado = jobs.obtener(job_id)
+    if estado is None or estado['estado'] != jobs.LISTO:
+        abort(404)
+    if estado['formato'] in jobs.FORMATOS_ADMIN and current_user.rol != 'admin':
+        abort(404)
+    extension = estado['archivo'].split('.', 1)[1]
     return send_file(
-        buffer,
-        mimetype='application/pdf',
+        jobs.ruta_archivo(estado),
+        mimetype=estado['mimetype'],
         as_attachment=True,
-        download_name=f'reporte_asistencias_{date.today()}.pdf'
-    ) 
\ No newline at end of file
+        download_name=f'asistencias_{date.today()}.{extension}'
+    )
+
+def _respuesta_exportacion(estado):
+    respuesta = {
+        'success': estado['estado'] != jobs.ERROR,
+        'job_id': estado['id'],
+        'estado': estado['estado'],
+        'progreso': estado['progreso'],
+        'url_estado': url_for('reports.estado_exportacion', job_id=estado['id'])
+    }
+    if estado['estado'] == jobs.LISTO:
+        respuesta['url_descarga'] = url_for('reports.descargar_exportacion', job_id=estado['id'])
+    if estado['error']:
+        respuesta['message'] = estado['error']
+    return respuesta
@@ -1,8 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file, abort
 from flask_login import login_required, current_user
 from extensions import db
 from models import Estudiante
-from datetime import datetime
+from services import identifiers, importer, qr, rollup, roster
 import qrcode
 from io import BytesIO
 import base64
@@ -32,8 +32,8 @@ def nuevo_estudiante():
                 flash('El tipo de estudiante es requerido', 'error')
                 return render_template('students/nuevo.html')
 
-            # Generar identificador único
-            identificador = f"EST{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            # Generar identificador único desde la secuencia
+            identificador = identifiers.siguiente()
             
             estudiante = Estudiante(
                 identificador=identificador,
@@ -44,6 +44,7 @@ def nuevo_estudiante():
             )
             db.session.add(estudiante)
             db.session.commit()
+            roster.invalidar()
             flash('Estudiante registrado exitosamente', 'success')
             return redirect(url_for('students.lista_estudiantes'))
         except Exception as e:
@@ -54,19 +55,44 @@ def nuevo_estudiante():
     
     return render_template('students/nuevo.html')
 
+@students_bp.route('/estudiantes/importar', methods=['GET', 'POST'])
+@login_required
+def importar_estudiantes():
+    resultado = None
+    if request.method == 'POST':
+        archivo = request.files.get('archivo')
+        if not archivo or not archivo.filename:
+            flash('Seleccione un archivo CSV o XLSX', 'error')
+            return render_template('students/importar.html')
+        try:
+            resultado = importer.importar(archivo.stream, archivo.filename)
+            flash(f"Se registraron {resultado['insertados']} de {resultado['total']} estudiantes",
+                  'success' if not resultado['errores'] else 'warning')
+        except ValueError as e:
+            flash(str(e), 'error')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error al importar los estudiantes: {str(e)}', 'error')
+    
+    return render_template('students/importar.html', resultado=resultado)
+
 @students_bp.route('/estudiantes/<int:id>/editar', methods=['GET', 'POST'])
 @login_required
 def editar_estudiante(id):
     estudiante = Estudiante.query.get_or_404(id)
     
     if request.method == 'POST':
+        anterior = (estudiante.curso, estudiante.tipo_estudiante)
         estudiante.nombre = request.form['nombre']
         estudiante.curso = request.form['curso']
         estudiante.tipo_estudiante = request.form['tipo_estudiante']
         estudiante.estado = request.form.get('estado', type=bool)
         
         try:
+            if (estudiante.curso, estudiante.tipo_estudiante) != anterior:
+                rollup.reubicar(estudiante.id)
             db.session.commit()
+            roster.invalidar()
             flash('Estudiante actualizado exitosamente', 'success')
             return redirect(url_for('students.lista_estudiantes'))
         except:
@@ -88,6 +114,7 @@ def toggle_estado(id):
     estudiante.estado = not estudiante.estado
     try:
         db.session.commit()
+        roster.invalidar()
         estado = "activado" if estudiante.estado else "desactivado"
         flash(f'Acceso al comedor {estado} exitosamente', 'success')
     except:
@@ -102,6 +129,22 @@ def generar_qr(student_id):
     estudiante = Estudiante.query.get_or_404(student_id)
     return render_template('students/qr.html', student=estudiante)
 
+@students_bp.route('/estudiantes/qr/<identificador>.<formato>')
+@login_required
+def qr_imagen(identificador, formato):
+    """Imagen QR del carné; el contenido es el identificador del estudiante"""
+    estudiante = roster.obtener(identificador)
+    if formato not in qr.FORMATOS or estudiante is None or estudiante.identificador != identificador:
+        abort(404)
+
+    ruta, etag = qr.obtener(identificador, formato)
+    # La imagen de un identificador nunca cambia: se puede guardar un año
+    respuesta = send_file(ruta, mimetype=qr.FORMATOS[formato], etag=etag, max_age=31536000)
+    respuesta.cache_control.public = False
+    respuesta.cache_control.private = True
+    respuesta.cache_control.immutable = True
+    return respuesta
+
 @students_bp.route('/api/estudiantes', methods=['POST'])
 @login_required
 def crear_estudiante():
@@ -117,8 +160,8 @@ def crear_estudiante():
                     'error': 'missing_field'
                 }), 400
 
-        # Generar identificador único
-        identificador = f"EST{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        # Generar identificador único desde la secuencia
+        identificador = identifiers.siguiente()
         
         # Si se envía grado, usarlo como curso
         curso = data.get('grado', data.get('curso'))
@@ -133,6 +176,7 @@ def crear_estudiante():
         
         db.session.add(estudiante)
         db.session.commit()
+        roster.invalidar()
         
         return jsonify({
             'success': True, 
@@ -155,6 +199,7 @@ def actualizar_estudiante(student_id):
     try:
         estudiante = Estudiante.query.get_or_404(student_id)
         data = request.json
+        anterior = (estudiante.curso, estudiante.tipo_estudiante)
         
         if 'nombre' in data:
             estudiante.nombre = data['nombre']
@@ -165,7 +210,10 @@ def actualizar_estudiante(student_id):
         if 'estado' in data:
             estudiante.estado = data['estado']
         
+        if (estudiante.curso, estudiante.tipo_estudiante) != anterior:
+            rollup.reubicar(estudiante.id)
         db.session.commit()
+        roster.invalidar()
         return jsonify({
             'success': True,
             'message': 'Estudiante actualizado exitosamente'
@@ -185,6 +233,7 @@ def toggle_status(student_id):
         estudiante = Estudiante.query.get_or_404(student_id)
         estudiante.estado = not estudiante.estado
         db.session.commit()
+        roster.invalidar()
         return jsonify({
             'success': True,
             'activo': estudiante.estado,
@@ -0,0 +1,177 @@
+from extensions import db
+from models import Asistencia
+from services import roster, rollup, schedule as horario, served as servidos
+from services.sql import insert_dialecto
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+# Columnas del índice único (estudiante, tipo de comida, día de servicio)
+COLUMNAS_UNICAS = ['estudiante_id', 'tipo', 'fecha']
+
+TIPOS_COMIDA = ('desayuno', 'almuerzo', 'cena')
+
+
+def momento_servicio():
+    """Fecha y hora locales con las que se registra una comida"""
+    ahora = datetime.now()
+    return ahora.date(), ahora.time().replace(microsecond=0)
+
+
+def registrada(estudiante_id, tipo, fecha):
+    """True si la comida ya está en asistencias; consulta el índice único"""
+    return db.session.query(db.exists().where(
+        Asistencia.estudiante_id == estudiante_id,
+        Asistencia.tipo == tipo,
+        Asistencia.fecha == fecha
+    )).scalar()
+
+
+def insertar_asistencia(estudiante_id, tipo, registrado_por=None, metodo_registro='manual',
+                        observaciones=None, fecha=None, hora=None):
+    """Inserta una asistencia en una sola sentencia.
+
+    Devuelve el id del registro creado, o None si el estudiante ya tenía esa
+    comida registrada en el día. También suma el registro a resumen_asistencias.
+    No hace commit: la transacción es del llamador.
+    """
+    if fecha is None or hora is None:
+        fecha, hora = momento_servicio()
+
+    valores = {
+        'estudiante_id': estudiante_id,
+        'tipo': tipo,
+        'fecha': fecha,
+        'hora': hora,
+        'metodo_registro': metodo_registro,
+        'registrado_por': registrado_por,
+        'observaciones': observaciones
+    }
+
+    insert = insert_dialecto()
+    if insert is not None:
+        sentencia = insert(Asistencia).values(**valores).on_conflict_do_nothing(
+            index_elements=COLUMNAS_UNICAS
+        ).returning(Asistencia.id)
+        asistencia_id = db.session.execute(sentencia).scalar()
+    else:
+        # Motores sin ON CONFLICT: se intenta el insert y se detecta el conflicto
+        try:
+            with db.session.begin_nested():
+                asistencia = Asistencia(**valores)
+                db.session.add(asistencia)
+            asistencia_id = asistencia.id
+        except IntegrityError:
+            asistencia_id = None
+
+    if asistencia_id is not None:
+        rollup.sumar([valores])
+    return asistencia_id
+
+
+def insertar_asistencias(filas):
+    """Inserta varias asistencias en una sola sentencia.
+
+    Cada fila es un diccionario con las columnas de Asistencia. Devuelve el
+    conjunto de pares (estudiante_id, tipo) efectivamente insertados; los que
+    chocan con el índice único se omiten. No hace commit.
+    """
+    if not filas:
+        return set()
+
+    insert = insert_dialecto()
+    if insert is None:
+        insertadas = set()
+        for fila in filas:
+            if insertar_asistencia(**fila) is not None:
+                insertadas.add((fila['estudiante_id'], fila['tipo']))
+        return insertadas
+
+    sentencia = insert(Asistencia).values(filas).on_conflict_do_nothing(
+        index_elements=COLUMNAS_UNICAS
+    ).returning(Asistencia.estudiante_id, Asistencia.tipo)
+    insertadas = {(fila.estudiante_id, fila.tipo) for fila in db.session.execute(sentencia)}
+    rollup.sumar(f for f in filas if (f['estudiante_id'], f['tipo']) in insertadas)
+    return insertadas
+
+
+def registrar_lote(items, registrado_por=None):
+    """Valida e inserta un lote de escaneos con un único insert.
+
+    Cada item trae 'estudiante_id' o 'identificador' y, opcionalmente, 'tipo';
+    sin tipo se asigna la comida del horario. Devuelve una lista de resultados
+    en el mismo orden que los items. No hace commit.
+    """
+    resultados = [None] * len(items)
+    estudiantes = {}
+    tipos = {}
+    fecha, hora = momento_servicio()
+
+    # Los estudiantes se resuelven contra el padrón en memoria
+    for indice, item in enumerate(items):
+        if not isinstance(item, dict):
+            resultados[indice] = {'success': False, 'message': 'Registro inválido'}
+            continue
+        tipo, error = horario.resolver(item.get('tipo'), fecha, hora)
+        if error:
+            resultados[indice] = {'success': False, 'message': error}
+            continue
+        valor = item.get('estudiante_id')
+        if valor is None:
+            valor = item.get('identificador')
+        if valor is None or valor == '':
+            resultados[indice] = {'success': False, 'message': 'Falta el estudiante'}
+            continue
+        estudiante = roster.obtener(valor)
+        if estudiante is None:
+            resultados[indice] = {'success': False, 'message': 'Estudiante no encontrado'}
+            continue
+        estudiantes[indice] = estudiante
+        tipos[indice] = tipo
+
+    filas = []
+    pendientes = {}
+    for indice, item in enumerate(items):
+        if resultados[indice] is not None:
+            continue
+        estudiante = estudiantes[indice]
+        tipo = tipos[indice]
+
+        resultado = {
+            'estudiante_id': estudiante.id,
+            'estudiante_nombre': estudiante.nombre,
+            'tipo': tipo,
+            'fecha': fecha.isoformat()
+        }
+        clave = (estudiante.id, tipo)
+        if not estudiante.estado:
+            resultado.update(success=False, message='El estudiante no está activo')
+        elif clave in pendientes or servidos.ya_servido(estudiante.id, tipo, fecha):
+            resultado.update(success=False, message=f'Ya existe un registro de {tipo} para este estudiante hoy')
+        else:
+            pendientes[clave] = indice
+            filas.append({
+                'estudiante_id': estudiante.id,
+                'tipo': tipo,
+                'fecha': fecha,
+                'hora': hora,
+                'metodo_registro': item.get('metodo_registro', 'QR'),
+                'registrado_por': registrado_por,
+                'observaciones': item.get('observaciones')
+            })
+        resultados[indice] = resultado
+
+    # Un solo insert; los conflictos son carreras con otro escáner
+    insertadas = insertar_asistencias(filas)
+    for clave, indice in pendientes.items():
+        if clave in insertadas:
+            resultados[indice].update(success=True, message='Asistencia registrada exitosamente')
+        else:
+            servidos.marcar_servido(clave[0], clave[1], fecha)
+            resultados[indice].update(
+                success=False,
+                message=f'Ya existe un registro de {clave[1]} para este estudiante hoy'
+            )
+
+    for indice, resultado in enumerate(resultados):
+        resultado['indice'] = indice
+    return resultados
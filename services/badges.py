@@ -0,0 +1,146 @@
+"""Hojas imprimibles de carnés con QR, por curso o para todo el colegio.
+
+Codificar los QR es lo costoso, así que se reparte en lotes entre procesos
+que escriben las imágenes en la caché de services.qr; el PDF se arma en una
+sola pasada, dibujando cada lote en cuanto está listo. Los carnés ya
+dibujados en la caché no se vuelven a codificar.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from services import qr, roster
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+import multiprocessing
+import os
+
+ESTUDIANTES_POR_LOTE = 200
+
+COLUMNAS = 3
+FILAS = 4
+MARGEN = 36
+ALTO_ENCABEZADO = 20
+TAMANO_QR = 110
+# Un píxel por módulo: el PDF escala la imagen sin suavizar, así que se
+# imprime nítida y cada carné pesa unos pocos cientos de bytes
+TAMANO_MODULO = 1
+
+
+def _dibujar_lote(carpeta, identificadores):
+    for identificador in identificadores:
+        qr.asegurar(carpeta, identificador, 'png', TAMANO_MODULO)
+    return len(identificadores)
+
+
+def _contexto_procesos():
+    # Nunca fork: el worker tiene hilos (exportaciones, ingesta, en vivo) y un
+    # hijo bifurcado podría heredar un lock tomado. Los hijos solo importan
+    # este módulo para codificar QR; no crean la aplicación.
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in metodos else 'spawn')
+
+
+def estudiantes(curso=None):
+    """Estudiantes activos del curso (o de todos), ordenados por curso y nombre"""
+    return sorted(
+        (e for e in roster.todos() if e.estado and (not curso or e.curso == curso)),
+        key=lambda e: (e.curso, e.nombre, e.id)
+    )
+
+
+def _recortar_texto(texto, fuente, tamano, ancho):
+    if stringWidth(texto, fuente, tamano) <= ancho:
+        return texto
+    while texto and stringWidth(texto + '…', fuente, tamano) > ancho:
+        texto = texto[:-1]
+    return texto + '…'
+
+
+class _Hoja:
+    """Coloca los carnés en una cuadrícula, con una página nueva por curso"""
+
+    def __init__(self, destino):
+        self.lienzo = canvas.Canvas(destino, pagesize=letter, pageCompression=1)
+        self.lienzo.setTitle('Carnés de estudiantes')
+        ancho, alto = letter
+        self.ancho_carne = (ancho - 2 * MARGEN) / COLUMNAS
+        self.alto_carne = (alto - 2 * MARGEN - ALTO_ENCABEZADO) / FILAS
+        self.tope = alto - MARGEN - ALTO_ENCABEZADO
+        self.posicion = 0
+        self.curso = None
+        self.pagina_vacia = True
+
+    def _nueva_pagina(self):
+        if not self.pagina_vacia:
+            self.lienzo.showPage()
+        self.lienzo.setFont('Helvetica-Bold', 11)
+        self.lienzo.drawString(MARGEN, self.tope + 6, f'Curso {self.curso}')
+        self.posicion = 0
+        self.pagina_vacia = False
+
+    def agregar(self, estudiante, imagen):
+        if estudiante.curso != self.curso or self.posicion == COLUMNAS * FILAS:
+            self.curso = estudiante.curso
+            self._nueva_pagina()
+
+        fila, columna = divmod(self.posicion, COLUMNAS)
+        x = MARGEN + columna * self.ancho_carne
+        y = self.tope - (fila + 1) * self.alto_carne
+        centro = x + self.ancho_carne / 2
+        ancho_texto = self.ancho_carne - 16
+
+        lienzo = self.lienzo
+        lienzo.setDash(3, 3)
+        lienzo.rect(x + 4, y + 4, self.ancho_carne - 8, self.alto_carne - 8)
+        lienzo.setDash()
+        lienzo.drawImage(imagen, centro - TAMANO_QR / 2, y + self.alto_carne - TAMANO_QR - 10,
+                         TAMANO_QR, TAMANO_QR)
+        lienzo.setFont('Helvetica-Bold', 10)
+        lienzo.drawCentredString(centro, y + 38, _recortar_texto(estudiante.nombre, 'Helvetica-Bold', 10, ancho_texto))
+        lienzo.setFont('Helvetica', 9)
+        lienzo.drawCentredString(centro, y + 25, f'Curso: {estudiante.curso}')
+        lienzo.setFont('Courier', 9)
+        lienzo.drawCentredString(centro, y + 13, estudiante.identificador)
+        self.posicion += 1
+
+    def guardar(self):
+        if self.pagina_vacia:
+            self.lienzo.setFont('Helvetica', 11)
+            self.lienzo.drawString(MARGEN, self.tope, 'No hay estudiantes activos para imprimir')
+        self.lienzo.save()
+
+
+def generar_pdf(destino, curso=None, progreso=None):
+    """Escribe el PDF de carnés del curso indicado, o de todo el colegio"""
+    lista = estudiantes(curso)
+    lotes = [lista[i:i + ESTUDIANTES_POR_LOTE] for i in range(0, len(lista), ESTUDIANTES_POR_LOTE)]
+    carpeta = qr.directorio()
+    hoja = _Hoja(destino)
+
+    if lotes:
+        procesos = min(len(lotes), current_app.config.get('CARNETS_PROCESOS') or multiprocessing.cpu_count())
+        with ProcessPoolExecutor(max_workers=procesos, mp_context=_contexto_procesos()) as pool:
+            # Solo se codifican los QR que faltan en la caché; cada lote se
+            # dibuja en la hoja mientras los siguientes se codifican
+            pendientes = []
+            for lote in lotes:
+                faltantes = [
+                    e.identificador for e in lote
+                    if not os.path.exists(qr.ruta(carpeta, e.identificador, 'png', TAMANO_MODULO))
+                ]
+                pendientes.append(pool.submit(_dibujar_lote, carpeta, faltantes) if faltantes else None)
+
+            dibujados = 0
+            for lote, pendiente in zip(lotes, pendientes):
+                if pendiente is not None:
+                    pendiente.result()
+                for estudiante in lote:
+                    ruta, _ = qr.asegurar(carpeta, estudiante.identificador, 'png', TAMANO_MODULO)
+                    hoja.agregar(estudiante, ruta)
+                dibujados += len(lote)
+                if progreso:
+                    progreso(dibujados)
+
+    hoja.guardar()
+    # Recortar al final, para no borrar imágenes que la hoja todavía iba a usar
+    qr.recortar()
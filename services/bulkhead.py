@@ -0,0 +1,108 @@
+"""Compartimentos de concurrencia por worker y rechazo rápido bajo carga.
+
+Cada compartimento limita cuántas peticiones de su grupo de rutas atiende a
+la vez un worker. Los reportes y exportaciones tienen pocos hilos, así que
+nunca ocupan los que necesita el escaneo. Si un compartimento está lleno y
+no se libera dentro de su espera, la petición recibe un 503 con Retry-After
+en vez de quedar en cola hasta el timeout de gunicorn.
+"""
+from collections import namedtuple
+from flask import Response, g, jsonify, request
+import threading
+
+Compartimento = namedtuple('Compartimento', 'semaforo espera reintentar')
+
+# Endpoints de escaneo: deben responder siempre, incluso con reportes en curso
+ESCANEO = {
+    'attendance.api_registrar_asistencia',
+    'attendance.api_registrar_lote',
+    'attendance.api_buscar_estudiante',
+}
+
+# Endpoints pesados de lectura; el sondeo del estado de una exportación es barato
+REPORTES_EXCLUIDOS = {'reports.estado_exportacion'}
+REPORTES_EXTRA = {
+    'attendance.historial_total',
+    'attendance.api_obtener_historial',
+    'attendance.resumen',
+}
+
+# Streams de contadores en vivo: cada uno ocupa un hilo mientras está abierto
+EN_VIVO = {'main.en_vivo'}
+
+_compartimentos = {}
+
+
+def _grupo(endpoint):
+    if endpoint in ESCANEO:
+        return 'escaneo'
+    if endpoint in REPORTES_EXTRA or (
+        endpoint.startswith('reports.') and endpoint not in REPORTES_EXCLUIDOS
+    ):
+        return 'reportes'
+    if endpoint in EN_VIVO:
+        return 'en_vivo'
+    return None
+
+
+def init_app(app):
+    """Crea los compartimentos según la configuración y registra los hooks"""
+    hilos = app.config.setdefault('HILOS_POR_WORKER', 1)
+    app.config.setdefault('ESCANEO_CONCURRENCIA', hilos)
+    app.config.setdefault('ESCANEO_ESPERA', 2.0)
+    app.config.setdefault('REPORTES_CONCURRENCIA', max(1, hilos // 4))
+    app.config.setdefault('REPORTES_ESPERA', 0.0)
+    # Con un solo hilo no hay streams: el navegador recibe 503 y consulta periódicamente
+    app.config.setdefault('EN_VIVO_CONCURRENCIA', hilos // 2)
+
+    _compartimentos['escaneo'] = Compartimento(
+        threading.BoundedSemaphore(app.config['ESCANEO_CONCURRENCIA']),
+        app.config['ESCANEO_ESPERA'],
+        1
+    )
+    _compartimentos['reportes'] = Compartimento(
+        threading.BoundedSemaphore(app.config['REPORTES_CONCURRENCIA']),
+        app.config['REPORTES_ESPERA'],
+        10
+    )
+    _compartimentos['en_vivo'] = Compartimento(
+        threading.BoundedSemaphore(app.config['EN_VIVO_CONCURRENCIA']),
+        0.0,
+        30
+    )
+
+    app.before_request(_entrar)
+    app.teardown_request(_salir)
+
+
+def _entrar():
+    grupo = _grupo(request.endpoint or '')
+    if grupo is None:
+        return None
+
+    compartimento = _compartimentos[grupo]
+    if compartimento.espera:
+        adquirido = compartimento.semaforo.acquire(timeout=compartimento.espera)
+    else:
+        adquirido = compartimento.semaforo.acquire(blocking=False)
+    if not adquirido:
+        return _ocupado(compartimento.reintentar)
+    g.compartimento = compartimento
+    return None
+
+
+def _salir(exc=None):
+    compartimento = g.pop('compartimento', None)
+    if compartimento is not None:
+        compartimento.semaforo.release()
+
+
+def _ocupado(segundos):
+    mensaje = 'El servidor está ocupado, intente de nuevo en unos segundos'
+    if request.path.startswith('/api/') or request.is_json:
+        respuesta = jsonify({'success': False, 'message': mensaje})
+    else:
+        respuesta = Response(mensaje, mimetype='text/plain')
+    respuesta.status_code = 503
+    respuesta.headers['Retry-After'] = str(segundos)
+    return respuesta
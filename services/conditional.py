@@ -0,0 +1,74 @@
+"""GET condicional (ETag / Last-Modified) a partir de los sellos de versión.
+
+Las vistas decoradas con @condicional responden 304 antes de ejecutar
+ninguna consulta cuando no cambió ninguna de las tablas que muestran. El
+ETag combina las versiones de las tablas, el día (las páginas muestran
+datos de hoy), el usuario, la URL y los archivos de la aplicación
+desplegada; Last-Modified es el cambio de tabla más reciente.
+"""
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from services import memo
+from datetime import date, datetime, time, timezone
+import hashlib
+import os
+
+# Tablas que afectan a cualquier página (nombre del usuario en la barra)
+TABLAS_COMUNES = ('usuarios',)
+
+_despliegue = None
+
+
+def _version_despliegue():
+    """Última modificación de plantillas y estáticos: un despliegue nuevo invalida los ETag"""
+    global _despliegue
+    if _despliegue is None:
+        ultima = 0
+        for carpeta in (current_app.template_folder, current_app.static_folder):
+            for raiz, _, archivos in os.walk(os.path.join(current_app.root_path, carpeta)):
+                for nombre in archivos:
+                    ultima = max(ultima, os.stat(os.path.join(raiz, nombre)).st_mtime_ns)
+        _despliegue = ultima
+    return _despliegue
+
+
+def validadores(tablas):
+    """(etag, last_modified) de la página según las tablas indicadas"""
+    actuales = memo.versiones(TABLAS_COMUNES + tuple(tablas))
+    hoy = date.today()
+    firma = repr((actuales, hoy, current_user.get_id(), request.full_path, _version_despliegue()))
+    etag = hashlib.sha1(firma.encode()).hexdigest()[:24]
+
+    # Nunca anterior al inicio del día: a medianoche cambian los datos de "hoy"
+    cambios = [actual[1] for actual in actuales if actual is not None]
+    segundos = max(max(cambios, default=0) / 1e9, datetime.combine(hoy, time.min).timestamp())
+    ultima = datetime.fromtimestamp(int(segundos), timezone.utc)
+    return etag, ultima
+
+
+def condicional(*tablas):
+    """Responde 304 si las tablas no cambiaron desde la versión que tiene el navegador"""
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            # Los mensajes flash pendientes solo se muestran renderizando la página
+            if '_flashes' in session:
+                return vista(*args, **kwargs)
+
+            etag, ultima = validadores(tablas)
+            if request.if_none_match:
+                vigente = request.if_none_match.contains_weak(etag)
+            else:
+                vigente = request.if_modified_since is not None and ultima <= request.if_modified_since
+
+            respuesta = make_response('', 304) if vigente else make_response(vista(*args, **kwargs))
+            if respuesta.status_code in (200, 304):
+                respuesta.set_etag(etag, weak=True)
+                respuesta.last_modified = ultima
+                # El navegador guarda la página pero la revalida en cada visita
+                respuesta.cache_control.private = True
+                respuesta.cache_control.no_cache = True
+            return respuesta
+        return envoltura
+    return decorador
@@ -0,0 +1,112 @@
+"""Perfiles del motor de base de datos.
+
+DB_PERFIL elige el perfil ('auto' por defecto lo deduce de la URI):
+
+- sqlite: WAL, synchronous=NORMAL, busy_timeout, caché y mmap, aplicados en
+  cada conexión nueva. Permite que varios workers escriban sin "database is locked".
+- postgres: pool con tamaño y desborde fijos, pre-ping y statement_timeout.
+- basico: las opciones por defecto de SQLAlchemy.
+
+Los valores se pueden ajustar con variables de entorno del mismo nombre que
+las claves de configuración.
+"""
+from sqlalchemy import event
+import os
+
+PERFILES = ('sqlite', 'postgres', 'basico')
+
+VALORES_POR_DEFECTO = {
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_CACHE_MB': 64,
+    'SQLITE_MMAP_MB': 256,
+    'DB_POOL_SIZE': 5,
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_STATEMENT_TIMEOUT_MS': 30000,
+}
+
+
+def _perfil(app):
+    perfil = os.environ.get('DB_PERFIL', app.config.get('DB_PERFIL', 'auto')).lower()
+    if perfil == 'auto':
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        if uri.startswith('sqlite'):
+            return 'sqlite'
+        if uri.startswith('postgres'):
+            return 'postgres'
+        return 'basico'
+    if perfil not in PERFILES:
+        raise ValueError(f'DB_PERFIL no válido: {perfil}')
+    return perfil
+
+
+def configurar(app):
+    """Fija las opciones del motor; llamar antes de db.init_app"""
+    for clave, valor in VALORES_POR_DEFECTO.items():
+        app.config.setdefault(clave, int(os.environ.get(clave, valor)))
+
+    perfil = _perfil(app)
+    opciones = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if perfil == 'sqlite':
+        opciones.setdefault('connect_args', {})['timeout'] = app.config['SQLITE_BUSY_TIMEOUT_MS'] / 1000
+    elif perfil == 'postgres':
+        opciones.update(
+            pool_size=app.config['DB_POOL_SIZE'],
+            max_overflow=app.config['DB_MAX_OVERFLOW'],
+            pool_recycle=app.config['DB_POOL_RECYCLE'],
+            pool_pre_ping=True
+        )
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opciones
+    app.config['DB_PERFIL_ACTIVO'] = perfil
+
+
+def registrar_eventos(app, db):
+    """Ajustes por conexión del perfil activo; llamar después de db.init_app"""
+    perfil = app.config['DB_PERFIL_ACTIVO']
+    with app.app_context():
+        engine = db.engine
+
+    if perfil == 'sqlite':
+        pragmas = (
+            'PRAGMA journal_mode=WAL',
+            'PRAGMA synchronous=NORMAL',
+            f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}",
+            f"PRAGMA cache_size=-{app.config['SQLITE_CACHE_MB'] * 1024}",
+            f"PRAGMA mmap_size={app.config['SQLITE_MMAP_MB'] * 1024 * 1024}",
+            'PRAGMA temp_store=MEMORY',
+        )
+
+        @event.listens_for(engine, 'connect')
+        def _pragmas_sqlite(conexion, registro):
+            cursor = conexion.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+    elif perfil == 'postgres':
+        limite = app.config['DB_STATEMENT_TIMEOUT_MS']
+
+        @event.listens_for(engine, 'connect')
+        def _limite_postgres(conexion, registro):
+            cursor = conexion.cursor()
+            cursor.execute(f'SET statement_timeout = {int(limite)}')
+            cursor.close()
+            conexion.commit()
+
+    app.logger.info('Base de datos: %s', descripcion(app))
+
+
+def descripcion(app):
+    """Resumen legible del perfil activo, para los registros de arranque"""
+    perfil = app.config['DB_PERFIL_ACTIVO']
+    if perfil == 'sqlite':
+        return (
+            f"perfil sqlite (WAL, synchronous=NORMAL, busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']} ms, "
+            f"caché {app.config['SQLITE_CACHE_MB']} MB, mmap {app.config['SQLITE_MMAP_MB']} MB)"
+        )
+    if perfil == 'postgres':
+        return (
+            f"perfil postgres (pool {app.config['DB_POOL_SIZE']}+{app.config['DB_MAX_OVERFLOW']}, pre_ping, "
+            f"statement_timeout={app.config['DB_STATEMENT_TIMEOUT_MS']} ms)"
+        )
+    return 'perfil basico (opciones por defecto de SQLAlchemy)'
@@ -0,0 +1,285 @@
+"""Generación de exportaciones de asistencias con memoria acotada.
+
+Las filas se leen de la base de datos por bloques y se codifican a medida
+que llegan, sin materializar el resultado completo.
+"""
+from extensions import db
+from models import Estudiante, Asistencia
+from services.attendance import TIPOS_COMIDA
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, CondPageBreak
+from reportlab.lib.styles import getSampleStyleSheet
+import csv
+import io
+import zlib
+
+FILAS_POR_BLOQUE = 1000
+
+COLUMNAS_CSV = ['Nombre', 'Identificador', 'Curso', 'Tipo de Estudiante', 'Fecha', 'Hora', 'Método']
+
+
+def consulta_asistencias(fecha_inicio=None, fecha_fin=None, *columnas_extra):
+    """Filas de detalle de asistencias, leídas de la base por bloques"""
+    query = db.session.query(
+        Estudiante.nombre,
+        Estudiante.identificador,
+        Estudiante.curso,
+        Estudiante.tipo_estudiante,
+        Asistencia.fecha,
+        Asistencia.hora,
+        Asistencia.metodo_registro,
+        *columnas_extra
+    ).join(Asistencia)
+
+    if fecha_inicio:
+        query = query.filter(Asistencia.fecha >= fecha_inicio)
+    if fecha_fin:
+        query = query.filter(Asistencia.fecha <= fecha_fin)
+
+    return query.order_by(
+        Asistencia.fecha.desc()
+    ).execution_options(stream_results=True).yield_per(FILAS_POR_BLOQUE)
+
+
+def generar_csv(fecha_inicio=None, fecha_fin=None, comprimir=False, progreso=None):
+    """Genera el CSV (UTF-8 con BOM para Excel) en bloques de bytes, opcionalmente en gzip.
+
+    progreso, si se indica, recibe el número de filas escritas tras cada bloque.
+    """
+    compresor = zlib.compressobj(wbits=31) if comprimir else None
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+
+    def vaciar():
+        datos = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compresor.compress(datos) if compresor else datos
+
+    # La cabecera sale de inmediato, antes de leer la primera fila
+    buffer.write('\ufeff')
+    escritor.writerow(COLUMNAS_CSV)
+    bloque = vaciar()
+    if compresor:
+        bloque += compresor.flush(zlib.Z_SYNC_FLUSH)
+    yield bloque
+
+    escritas = 0
+    for fila in consulta_asistencias(fecha_inicio, fecha_fin):
+        escritor.writerow(fila)
+        escritas += 1
+        if escritas % FILAS_POR_BLOQUE == 0:
+            if progreso:
+                progreso(escritas)
+            bloque = vaciar()
+            if bloque:
+                yield bloque
+
+    if progreso:
+        progreso(escritas)
+    bloque = vaciar()
+    if compresor:
+        bloque += compresor.flush()
+    if bloque:
+        yield bloque
+
+
+def escribir_csv(destino, fecha_inicio=None, fecha_fin=None, comprimir=False, progreso=None):
+    """Escribe el CSV en un archivo binario abierto"""
+    for bloque in generar_csv(fecha_inicio, fecha_fin, comprimir, progreso):
+        destino.write(bloque)
+
+
+def generar_xlsx(destino, fecha_inicio=None, fecha_fin=None, progreso=None):
+    """Escribe un libro de Excel con una hoja por tipo de comida.
+
+    Usa un libro de solo escritura de openpyxl: las filas van al disco a
+    medida que llegan de la base, y fecha y hora quedan como celdas tipadas.
+    """
+    libro = Workbook(write_only=True)
+    hojas = {}
+    negrita = Font(bold=True)
+
+    def hoja(tipo):
+        if tipo not in hojas:
+            nueva = libro.create_sheet(title=(tipo or 'sin tipo').capitalize())
+            nueva.column_dimensions['A'].width = 35
+            nueva.column_dimensions['B'].width = 20
+            encabezado = []
+            for titulo in COLUMNAS_CSV:
+                celda = WriteOnlyCell(nueva, value=titulo)
+                celda.font = negrita
+                encabezado.append(celda)
+            nueva.append(encabezado)
+            hojas[tipo] = nueva
+        return hojas[tipo]
+
+    # Las hojas de cada comida existen aunque no tengan filas
+    for tipo in TIPOS_COMIDA:
+        hoja(tipo)
+
+    escritas = 0
+    for fila in consulta_asistencias(fecha_inicio, fecha_fin, Asistencia.tipo):
+        *valores, tipo = fila
+        destino_hoja = hoja(tipo)
+        celda_fecha = WriteOnlyCell(destino_hoja, value=valores[4])
+        celda_fecha.number_format = 'DD/MM/YYYY'
+        celda_hora = WriteOnlyCell(destino_hoja, value=valores[5])
+        celda_hora.number_format = 'HH:MM:SS'
+        destino_hoja.append(valores[:4] + [celda_fecha, celda_hora, valores[6]])
+
+        escritas += 1
+        if progreso and escritas % FILAS_POR_BLOQUE == 0:
+            progreso(escritas)
+
+    libro.save(destino)
+    if progreso:
+        progreso(escritas)
+
+
+# Filas por tabla del PDF: cada tabla cabe en una página, así el armado es lineal
+FILAS_POR_TABLA = 35
+
+ANCHOS_PDF = [170, 110, 60, 60, 68]
+
+ESTILO_TABLA_PDF = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+ENCABEZADO_PDF = ['Nombre', 'Identificador', 'Curso', 'Tipo', 'Total Asistencias']
+
+
+class _DocumentoPorBloques(SimpleDocTemplate):
+    """Documento que recibe sus flowables de un generador durante build.
+
+    Usa handle_flowable, el punto de extensión de BaseDocTemplate que
+    procesa el primer flowable de la lista: antes de cada uno se repone la
+    lista desde el generador, así que nunca hay más de unas pocas tablas
+    armadas a la vez.
+    """
+
+    # Flowables por delante del actual, para que keepWithNext pueda mirarlos
+    VENTANA = 4
+
+    def __init__(self, destino, generador, **kwargs):
+        super().__init__(destino, **kwargs)
+        self._generador = generador
+        self._historia = []
+
+    def _reponer(self, flowables):
+        while len(flowables) < self.VENTANA:
+            siguiente = next(self._generador, None)
+            if siguiente is None:
+                return
+            flowables.append(siguiente)
+
+    def handle_flowable(self, flowables):
+        # reportlab también lo llama con sus listas internas; solo se repone la historia
+        if flowables is self._historia:
+            self._reponer(flowables)
+        super().handle_flowable(flowables)
+        if flowables is self._historia:
+            self._reponer(flowables)
+
+    def construir(self):
+        self._reponer(self._historia)
+        self.build(self._historia)
+
+
+def _tabla_pdf(filas):
+    tabla = Table([ENCABEZADO_PDF] + filas, colWidths=ANCHOS_PDF, repeatRows=1)
+    tabla.setStyle(ESTILO_TABLA_PDF)
+    return tabla
+
+
+def _flowables_pdf(resultados, fecha_inicio, fecha_fin, progreso):
+    styles = getSampleStyleSheet()
+    yield Paragraph("Reporte de Asistencias", styles['Title'])
+    yield Paragraph(f"Período: {fecha_inicio or 'inicio'} a {fecha_fin or 'hoy'}", styles['Normal'])
+
+    curso_actual = None
+    total_curso = 0
+    bloque = []
+    leidas = 0
+    for r in resultados:
+        if r.curso != curso_actual:
+            if bloque:
+                yield _tabla_pdf(bloque)
+                bloque = []
+            if curso_actual is not None:
+                yield Paragraph(f"Total del curso: {total_curso}", styles['Normal'])
+            curso_actual = r.curso
+            total_curso = 0
+            yield CondPageBreak(120)
+            yield Paragraph(f"Curso {curso_actual}", styles['Heading2'])
+
+        bloque.append([r.nombre, r.identificador, r.curso, r.tipo_estudiante, str(r.total_asistencias)])
+        total_curso += r.total_asistencias
+        if len(bloque) == FILAS_POR_TABLA:
+            yield _tabla_pdf(bloque)
+            bloque = []
+
+        leidas += 1
+        if progreso and leidas % FILAS_POR_BLOQUE == 0:
+            progreso(leidas)
+
+    if bloque:
+        yield _tabla_pdf(bloque)
+    if curso_actual is None:
+        yield Paragraph("No hay asistencias en el período", styles['Normal'])
+    else:
+        yield Paragraph(f"Total del curso: {total_curso}", styles['Normal'])
+    if progreso:
+        progreso(leidas)
+
+
+def generar_pdf(destino, fecha_inicio=None, fecha_fin=None, progreso=None):
+    """Escribe el reporte PDF de totales por estudiante, por secciones de curso.
+
+    Las filas llegan de la base por bloques y las tablas se arman a medida que
+    reportlab avanza, sin tener todas las tablas armadas a la vez. destino es
+    un archivo abierto (el temporal del trabajo de exportación).
+    """
+    query = db.session.query(
+        Estudiante.nombre,
+        Estudiante.identificador,
+        Estudiante.curso,
+        Estudiante.tipo_estudiante,
+        db.func.count(Asistencia.id).label('total_asistencias')
+    ).join(Asistencia)
+    
+    if fecha_inicio:
+        query = query.filter(Asistencia.fecha >= fecha_inicio)
+    if fecha_fin:
+        query = query.filter(Asistencia.fecha <= fecha_fin)
+    
+    resultados = query.group_by(
+        Estudiante.id,
+        Estudiante.nombre,
+        Estudiante.identificador,
+        Estudiante.curso,
+        Estudiante.tipo_estudiante
+    ).order_by(
+        Estudiante.curso,
+        Estudiante.nombre,
+        Estudiante.id
+    ).execution_options(stream_results=True).yield_per(FILAS_POR_BLOQUE)
+    
+    _DocumentoPorBloques(
+        destino, _flowables_pdf(resultados, fecha_inicio, fecha_fin, progreso),
+        pagesize=letter, pageCompression=1
+    ).construir()
@@ -0,0 +1,39 @@
+"""Paginación por cursor (keyset) del historial de asistencias.
+
+Las páginas se ordenan por (fecha, hora, id) descendente y cada una continúa
+donde terminó la anterior, así que el costo no crece con el número de página.
+"""
+from models import Asistencia
+from datetime import date, time
+from sqlalchemy import tuple_
+import base64
+
+COLUMNAS = (Asistencia.fecha, Asistencia.hora, Asistencia.id)
+
+
+def codificar_cursor(asistencia):
+    valor = f'{asistencia.fecha.isoformat()}|{asistencia.hora.isoformat()}|{asistencia.id}'
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, hora, id); lanza ValueError si el cursor no es válido"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        fecha, hora, asistencia_id = base64.urlsafe_b64decode(cursor + relleno).decode().split('|')
+        return date.fromisoformat(fecha), time.fromisoformat(hora), int(asistencia_id)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError('Cursor no válido') from e
+
+
+def pagina(consulta, cursor=None, limite=50):
+    """Devuelve (asistencias, siguiente_cursor) a partir de una consulta filtrada"""
+    if cursor:
+        consulta = consulta.filter(tuple_(*COLUMNAS) < tuple_(*decodificar_cursor(cursor)))
+
+    asistencias = consulta.order_by(*[columna.desc() for columna in COLUMNAS]).limit(limite + 1).all()
+    siguiente = None
+    if len(asistencias) > limite:
+        asistencias = asistencias[:limite]
+        siguiente = codificar_cursor(asistencias[-1])
+    return asistencias, siguiente
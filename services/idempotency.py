@@ -0,0 +1,79 @@
+from flask import current_app, jsonify
+from extensions import db
+from models import ClaveIdempotencia
+from services import ingest
+from datetime import datetime, timedelta
+import json
+import time
+
+LONGITUD_MAXIMA = 100
+
+# Momento de la última purga en este worker
+_ultima_purga = 0.0
+
+
+def _vigencia():
+    return timedelta(seconds=current_app.config.get('IDEMPOTENCIA_TTL', 24 * 3600))
+
+
+def clave_valida(clave):
+    return 0 < len(clave) <= LONGITUD_MAXIMA
+
+
+def buscar_respuesta(clave, usuario_id):
+    """Devuelve la respuesta guardada para la clave, o None si no existe o expiró"""
+    # Respuesta confirmada por la ingesta diferida que aún espera su lote
+    cuerpo = ingest.respuesta_pendiente(clave, usuario_id)
+    if cuerpo is not None:
+        return _repetida(cuerpo, 200)
+
+    registro = db.session.query(ClaveIdempotencia.codigo, ClaveIdempotencia.respuesta).filter(
+        ClaveIdempotencia.usuario_id == usuario_id,
+        ClaveIdempotencia.clave == clave,
+        ClaveIdempotencia.fecha_creacion >= datetime.utcnow() - _vigencia()
+    ).first()
+    if registro is None:
+        return None
+
+    return _repetida(json.loads(registro.respuesta), registro.codigo)
+
+
+def _repetida(cuerpo, codigo):
+    respuesta = jsonify(cuerpo)
+    respuesta.status_code = codigo
+    respuesta.headers['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+
+def guardar_respuesta(clave, usuario_id, cuerpo, codigo=200):
+    """Guarda la respuesta en la misma transacción que la operación. No hace commit."""
+    db.session.add(ClaveIdempotencia(
+        clave=clave,
+        usuario_id=usuario_id,
+        codigo=codigo,
+        respuesta=json.dumps(cuerpo)
+    ))
+    _purgar()
+
+
+def _purgar():
+    """Elimina claves expiradas y recorta el registro al tamaño máximo"""
+    global _ultima_purga
+    intervalo = current_app.config.get('IDEMPOTENCIA_PURGA_INTERVALO', 60)
+    ahora = time.monotonic()
+    if ahora - _ultima_purga < intervalo:
+        return
+    _ultima_purga = ahora
+
+    ClaveIdempotencia.query.filter(
+        ClaveIdempotencia.fecha_creacion < datetime.utcnow() - _vigencia()
+    ).delete(synchronize_session=False)
+
+    maximo = current_app.config.get('IDEMPOTENCIA_MAX', 50000)
+    limite = db.session.query(ClaveIdempotencia.id).order_by(
+        ClaveIdempotencia.id.desc()
+    ).offset(maximo).limit(1).scalar()
+    if limite is not None:
+        ClaveIdempotencia.query.filter(
+            ClaveIdempotencia.id <= limite
+        ).delete(synchronize_session=False)
@@ -0,0 +1,75 @@
+"""Identificadores de estudiantes a partir de una secuencia en la base de datos.
+
+Los números se reservan por bloques con un UPDATE atómico en su propia
+transacción, así dos peticiones (o dos workers) nunca reciben el mismo número,
+aunque lleguen en el mismo segundo. Los números de un bloque que no se usen se
+pierden; los identificadores no necesitan ser consecutivos.
+"""
+from extensions import db
+from models import Secuencia
+from services.sql import insert_dialecto
+from datetime import date
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+import threading
+
+SECUENCIA = 'estudiantes'
+
+# Números que cada worker reserva de una vez para las altas individuales
+BLOQUE = 20
+
+_lock = threading.Lock()
+_siguiente = 0
+_limite = 0
+
+
+def formatear(numero, anio=None):
+    """EST + año de alta + número de seis cifras: EST2025000123"""
+    return f'EST{anio or date.today().year}{numero:06d}'
+
+
+def reservar(cantidad, nombre=SECUENCIA):
+    """Reserva `cantidad` números y devuelve el range correspondiente"""
+    with db.engine.begin() as conexion:
+        actualizados = conexion.execute(
+            update(Secuencia).where(Secuencia.nombre == nombre).values(valor=Secuencia.valor + cantidad)
+        ).rowcount
+        if not actualizados:
+            _crear(conexion, nombre, cantidad)
+        ultimo = conexion.execute(select(Secuencia.valor).where(Secuencia.nombre == nombre)).scalar_one()
+    return range(ultimo - cantidad + 1, ultimo + 1)
+
+
+def _crear(conexion, nombre, cantidad):
+    insert_conflictos = insert_dialecto()
+    if insert_conflictos is not None:
+        conexion.execute(
+            insert_conflictos(Secuencia).values(nombre=nombre, valor=0).on_conflict_do_nothing()
+        )
+    else:
+        try:
+            with conexion.begin_nested():
+                conexion.execute(Secuencia.__table__.insert().values(nombre=nombre, valor=0))
+        except IntegrityError:
+            pass
+    conexion.execute(
+        update(Secuencia).where(Secuencia.nombre == nombre).values(valor=Secuencia.valor + cantidad)
+    )
+
+
+def generar(cantidad):
+    """Lista de `cantidad` identificadores nuevos, de un solo bloque"""
+    anio = date.today().year
+    return [formatear(numero, anio) for numero in reservar(cantidad)]
+
+
+def siguiente():
+    """Un identificador nuevo, tomado del bloque reservado por este worker"""
+    global _siguiente, _limite
+    with _lock:
+        if _siguiente >= _limite:
+            bloque = reservar(BLOQUE)
+            _siguiente, _limite = bloque.start, bloque.stop
+        numero = _siguiente
+        _siguiente += 1
+    return formatear(numero)
@@ -0,0 +1,157 @@
+"""Importación masiva de estudiantes desde CSV o XLSX.
+
+Todas las filas se validan de una vez con pandas; las válidas reciben
+identificadores de un solo bloque de la secuencia y se insertan con
+sentencias masivas, en transacciones de FILAS_POR_LOTE filas. Cada fila
+rechazada se informa con su número de fila en el archivo.
+"""
+from extensions import db
+from models import Estudiante
+from services import identifiers, roster
+from services.search import normalizar
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+import pandas as pd
+
+FILAS_POR_LOTE = 1000
+
+EXTENSIONES = ('csv', 'xlsx')
+
+TIPOS_ESTUDIANTE = ('becado', 'pagado')
+
+# Encabezados aceptados (ya normalizados) -> columna
+ALIAS_COLUMNAS = {
+    'nombre': 'nombre',
+    'nombre completo': 'nombre',
+    'curso': 'curso',
+    'grado': 'curso',
+    'tipo': 'tipo_estudiante',
+    'tipo estudiante': 'tipo_estudiante',
+    'tipo de estudiante': 'tipo_estudiante',
+    'tipo_estudiante': 'tipo_estudiante',
+    'identificador': 'identificador',
+}
+
+
+def leer(archivo, nombre_archivo):
+    """DataFrame de texto a partir del archivo subido; lanza ValueError si no se puede leer"""
+    extension = nombre_archivo.rsplit('.', 1)[-1].lower() if '.' in nombre_archivo else ''
+    if extension not in EXTENSIONES:
+        raise ValueError('El archivo debe ser CSV o XLSX')
+    try:
+        if extension == 'csv':
+            datos = pd.read_csv(archivo, dtype=str, keep_default_na=False, encoding='utf-8-sig', sep=None, engine='python')
+        else:
+            datos = pd.read_excel(archivo, dtype=str, keep_default_na=False)
+    except Exception as e:
+        raise ValueError(f'No se pudo leer el archivo: {str(e)}') from e
+
+    datos = datos.rename(columns=lambda c: ALIAS_COLUMNAS.get(normalizar(c), normalizar(c)))
+    faltantes = [c for c in ('nombre', 'curso') if c not in datos.columns]
+    if faltantes:
+        raise ValueError(f'Faltan columnas en el archivo: {", ".join(faltantes)}')
+    return datos
+
+
+def validar(datos):
+    """Normaliza las columnas y devuelve (datos, errores), con errores alineado a las filas.
+
+    errores tiene el primer problema de cada fila, o '' si la fila es válida.
+    """
+    datos = pd.DataFrame({
+        'nombre': datos['nombre'].fillna('').astype(str).str.strip().str.split().str.join(' '),
+        'curso': datos['curso'].fillna('').astype(str).str.strip(),
+        'tipo_estudiante': datos.get('tipo_estudiante', pd.Series('', index=datos.index))
+            .fillna('').astype(str).str.strip().str.lower().replace('', 'pagado'),
+        'identificador': datos.get('identificador', pd.Series('', index=datos.index))
+            .fillna('').astype(str).str.strip(),
+    }, index=datos.index)
+    errores = pd.Series('', index=datos.index)
+
+    def marcar(mascara, mensaje):
+        errores[mascara & (errores == '')] = mensaje
+
+    existentes = roster.todos()
+    identificadores_usados = {e.identificador for e in existentes}
+    # Nombre normalizado y curso, para detectar estudiantes ya registrados o repetidos
+    matriculados = {f'{normalizar(e.nombre)}\x1f{e.curso}' for e in existentes}
+    claves = datos['nombre'].map(normalizar) + '\x1f' + datos['curso']
+
+    marcar(datos['nombre'] == '', 'El nombre es requerido')
+    marcar(datos['curso'] == '', 'El curso es requerido')
+    marcar(datos['nombre'].str.len() > 100, 'El nombre supera los 100 caracteres')
+    marcar(datos['curso'].str.len() > 50, 'El curso supera los 50 caracteres')
+    marcar(~datos['tipo_estudiante'].isin(TIPOS_ESTUDIANTE), 'El tipo de estudiante debe ser becado o pagado')
+
+    con_identificador = datos['identificador'] != ''
+    marcar(datos['identificador'].str.len() > 20, 'El identificador supera los 20 caracteres')
+    marcar(con_identificador & datos['identificador'].isin(identificadores_usados), 'El identificador ya existe')
+    marcar(con_identificador & datos['identificador'].duplicated(keep='first'), 'Identificador repetido en el archivo')
+
+    marcar(claves.isin(matriculados), 'El estudiante ya está registrado en ese curso')
+    marcar(claves.duplicated(keep='first'), 'Fila repetida en el archivo')
+    return datos, errores
+
+
+def _fila_archivo(indice):
+    # El encabezado es la fila 1 del archivo
+    return int(indice) + 2
+
+
+def importar(archivo, nombre_archivo):
+    """Valida e inserta los estudiantes del archivo.
+
+    Devuelve {'total', 'insertados', 'errores': [{'fila', 'nombre', 'mensaje'}]}.
+    Lanza ValueError si el archivo no se puede leer.
+    """
+    datos, errores = validar(leer(archivo, nombre_archivo))
+    rechazos = [
+        {'fila': _fila_archivo(indice), 'nombre': datos.at[indice, 'nombre'], 'mensaje': mensaje}
+        for indice, mensaje in errores[errores != ''].items()
+    ]
+
+    validos = datos[errores == '']
+    sin_identificador = validos['identificador'] == ''
+    if sin_identificador.any():
+        validos = validos.copy()
+        validos.loc[sin_identificador, 'identificador'] = identifiers.generar(int(sin_identificador.sum()))
+
+    filas = [
+        dict(fila, estado=True, indice=indice)
+        for indice, fila in zip(validos.index, validos.to_dict('records'))
+    ]
+    insertados = 0
+    for inicio in range(0, len(filas), FILAS_POR_LOTE):
+        lote = filas[inicio:inicio + FILAS_POR_LOTE]
+        insertados += _insertar_lote(lote, rechazos)
+
+    if insertados:
+        roster.invalidar()
+    rechazos.sort(key=lambda r: r['fila'])
+    return {'total': len(datos), 'insertados': insertados, 'errores': rechazos}
+
+
+def _insertar_lote(lote, rechazos):
+    """Inserta el lote en una transacción; si choca con la base, fila por fila"""
+    valores = [{k: v for k, v in fila.items() if k != 'indice'} for fila in lote]
+    try:
+        db.session.execute(insert(Estudiante), valores)
+        db.session.commit()
+        return len(lote)
+    except IntegrityError:
+        db.session.rollback()
+
+    insertados = 0
+    for fila, valor in zip(lote, valores):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Estudiante), [valor])
+            insertados += 1
+        except IntegrityError:
+            rechazos.append({
+                'fila': _fila_archivo(fila['indice']),
+                'nombre': fila['nombre'],
+                'mensaje': 'El identificador ya existe'
+            })
+    db.session.commit()
+    return insertados
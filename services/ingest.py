@@ -0,0 +1,327 @@
+"""Ingesta diferida de asistencias (ASISTENCIA_DIFERIDA).
+
+El escaneo ya validado se añade a un registro en disco y se confirma en el
+momento; un hilo por worker lo pasa a asistencias en lotes, cada
+INGESTA_INTERVALO_MS milisegundos o INGESTA_LOTE_MAX filas, con un commit
+por lote en vez de uno por escaneo.
+
+Cada worker escribe su propio archivo en CACHE_DIR/ingesta y lo mantiene
+bloqueado mientras vive. Un archivo sin bloqueo es de un worker que terminó:
+el siguiente que arranca lo vuelve a aplicar, y el índice único omite las
+filas que ya estaban insertadas.
+
+Si un lote falla por algo distinto de una base de datos no disponible, se
+aplica fila por fila; las que siguen fallando (por ejemplo, un estudiante
+borrado) se apartan en CACHE_DIR/ingesta/descartados.jsonl con un error en
+el log, para que no bloqueen los escaneos que vienen detrás.
+
+Antes de confirmar un escaneo se comprueba el índice único de asistencias
+y se reserva el escaneo con un archivo creado con O_EXCL en
+CACHE_DIR/ingesta/servidos/<fecha>: la reserva es atómica entre workers,
+así que un reescaneo en otro worker, aún sin llegar a la base, se rechaza
+igual que en el modo síncrono.
+"""
+from collections import deque
+from itertools import islice
+from flask import current_app
+from extensions import db
+from models import ClaveIdempotencia
+from services import served as servidos
+from services.attendance import insertar_asistencias
+from services.sql import insert_dialecto
+from datetime import date, datetime, time as hora_del_dia
+from sqlalchemy.exc import OperationalError
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+
+# Protege el archivo del registro, la cola y las respuestas pendientes
+_lock = threading.Lock()
+# Solo un vaciado a la vez (hilo escritor o detener)
+_lock_vaciado = threading.Lock()
+_aviso = threading.Event()
+_pendientes = deque()
+_respuestas = {}
+_archivo = None
+_ruta = None
+_hilo = None
+_dia_reservas = None
+
+
+def activa():
+    return current_app.config.get('ASISTENCIA_DIFERIDA', False)
+
+
+def _directorio():
+    directorio = os.path.join(current_app.config['CACHE_DIR'], 'ingesta')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _leer(linea):
+    entrada = json.loads(linea)
+    fila = entrada['fila']
+    fila['fecha'] = date.fromisoformat(fila['fecha'])
+    fila['hora'] = hora_del_dia.fromisoformat(fila['hora'])
+    return entrada
+
+
+def iniciar():
+    """Recupera los registros de workers terminados y arranca el escritor"""
+    global _archivo, _ruta, _hilo
+    if _hilo is not None:
+        return
+    with _lock:
+        if _hilo is not None:
+            return
+        directorio = _directorio()
+        _recuperar(directorio)
+
+        # Se bloquea antes de tener el nombre .log que buscan los demás
+        # workers al recuperar; si no, otro podría tomarlo por huérfano y borrarlo
+        _ruta = os.path.join(directorio, f'{os.getpid()}-{time.time_ns()}.log')
+        temporal = f'{_ruta}.tmp'
+        _archivo = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        fcntl.flock(_archivo, fcntl.LOCK_EX)
+        os.rename(temporal, _ruta)
+
+        app = current_app._get_current_object()
+        _hilo = threading.Thread(target=_escritor, args=(app,), name='ingesta', daemon=True)
+        _hilo.start()
+
+
+def _recuperar(directorio):
+    for nombre in sorted(os.listdir(directorio)):
+        if not nombre.endswith('.log'):
+            continue
+        ruta = os.path.join(directorio, nombre)
+        try:
+            archivo = open(ruta, 'r+')
+        except FileNotFoundError:
+            continue
+        with archivo:
+            try:
+                fcntl.flock(archivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # Registro de un worker vivo
+
+            entradas = []
+            for linea in archivo:
+                try:
+                    entradas.append(_leer(linea))
+                except (ValueError, KeyError):
+                    # Solo la última línea puede quedar cortada por una caída
+                    current_app.logger.warning('Línea no válida en %s: %r', nombre, linea)
+            lote = current_app.config.get('INGESTA_LOTE_MAX', 500)
+            for inicio in range(0, len(entradas), lote):
+                _aplicar_o_descartar(entradas[inicio:inicio + lote], lambda resueltas: None)
+            if entradas:
+                current_app.logger.info('Ingesta: %d escaneos recuperados de %s', len(entradas), nombre)
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+
+
+def encolar(fila, clave=None, usuario_id=None, cuerpo=None):
+    """Añade el escaneo al registro en disco; al volver ya es durable.
+
+    clave y cuerpo son los de Idempotency-Key: la respuesta se guarda en
+    claves_idempotencia junto con el lote.
+    """
+    iniciar()
+    entrada = {'fila': fila, 'clave': clave, 'usuario_id': usuario_id, 'cuerpo': cuerpo}
+    linea = (json.dumps(entrada, default=str) + '\n').encode()
+    with _lock:
+        os.write(_archivo, linea)
+        _pendientes.append(entrada)
+        if clave:
+            _respuestas[(usuario_id, clave)] = cuerpo
+        archivo = _archivo
+    # Fuera del lock: los escaneos concurrentes comparten el mismo fdatasync
+    if current_app.config.get('INGESTA_FSYNC', True):
+        os.fdatasync(archivo)
+    _aviso.set()
+
+
+def _reserva(estudiante_id, tipo, fecha):
+    global _dia_reservas
+    raiz = os.path.join(_directorio(), 'servidos')
+    directorio = os.path.join(raiz, fecha.isoformat())
+    if _dia_reservas != fecha:
+        # Las reservas de días anteriores ya no sirven
+        for nombre in os.listdir(raiz) if os.path.isdir(raiz) else ():
+            if nombre < fecha.isoformat():
+                shutil.rmtree(os.path.join(raiz, nombre), ignore_errors=True)
+        os.makedirs(directorio, exist_ok=True)
+        _dia_reservas = fecha
+    return os.path.join(directorio, f'{tipo}-{estudiante_id}')
+
+
+def reservar(estudiante_id, tipo, fecha):
+    """Marca la comida como servida para todos los workers; False si ya lo estaba"""
+    try:
+        os.close(os.open(_reserva(estudiante_id, tipo, fecha), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+    except FileExistsError:
+        return False
+    return True
+
+
+def liberar(estudiante_id, tipo, fecha):
+    """Deshace una reserva cuyo escaneo no llegó a encolarse"""
+    try:
+        os.remove(_reserva(estudiante_id, tipo, fecha))
+    except FileNotFoundError:
+        pass
+
+
+def respuesta_pendiente(clave, usuario_id):
+    """Cuerpo de una respuesta con Idempotency-Key que aún no llegó a la base de datos"""
+    with _lock:
+        return _respuestas.get((usuario_id, clave))
+
+
+def _guardar_claves(entradas):
+    filas = [
+        {'clave': e['clave'], 'usuario_id': e['usuario_id'], 'codigo': 200, 'respuesta': json.dumps(e['cuerpo'])}
+        for e in entradas if e.get('clave')
+    ]
+    if not filas:
+        return
+
+    insert = insert_dialecto()
+    if insert is not None:
+        db.session.execute(insert(ClaveIdempotencia).values(filas).on_conflict_do_nothing(
+            index_elements=['usuario_id', 'clave']
+        ))
+        return
+
+    existentes = set(db.session.query(ClaveIdempotencia.usuario_id, ClaveIdempotencia.clave).filter(
+        ClaveIdempotencia.clave.in_([f['clave'] for f in filas])
+    ))
+    for fila in filas:
+        if (fila['usuario_id'], fila['clave']) not in existentes:
+            existentes.add((fila['usuario_id'], fila['clave']))
+            db.session.add(ClaveIdempotencia(**fila))
+
+
+def _aplicar(entradas):
+    """Inserta un lote de entradas del registro y hace commit"""
+    filas = []
+    vistas = set()
+    for entrada in entradas:
+        fila = entrada['fila']
+        clave = (fila['estudiante_id'], fila['tipo'], fila['fecha'])
+        if clave not in vistas:
+            vistas.add(clave)
+            filas.append(fila)
+
+    insertar_asistencias(filas)
+    _guardar_claves(entradas)
+    db.session.commit()
+    for fila in filas:
+        servidos.marcar_servido(fila['estudiante_id'], fila['tipo'], fila['fecha'])
+
+
+def _descartar(entrada, error):
+    """Aparta una entrada que no se puede insertar"""
+    current_app.logger.error(
+        'Ingesta: escaneo descartado (estudiante %s, %s, %s): %s',
+        entrada['fila'].get('estudiante_id'), entrada['fila'].get('tipo'), entrada['fila'].get('fecha'), error
+    )
+    registro = dict(entrada, error=str(error), descartado=datetime.utcnow().isoformat())
+    with open(os.path.join(_directorio(), 'descartados.jsonl'), 'a') as archivo:
+        archivo.write(json.dumps(registro, default=str) + '\n')
+        archivo.flush()
+        os.fsync(archivo.fileno())
+
+
+def _aplicar_o_descartar(entradas, retirar):
+    """Aplica el lote; si falla, fila por fila, descartando las que siguen fallando.
+
+    Llama a retirar(entradas) después de cada commit o descarte. Deja pasar
+    OperationalError (base de datos no disponible): el lote se reintenta.
+    """
+    try:
+        _aplicar(entradas)
+    except OperationalError:
+        db.session.rollback()
+        raise
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Ingesta: falló un lote de %d escaneos; se aplica fila por fila', len(entradas))
+    else:
+        retirar(entradas)
+        return
+
+    for entrada in entradas:
+        try:
+            _aplicar([entrada])
+        except OperationalError:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            _descartar(entrada, e)
+        retirar([entrada])
+
+
+def _retirar(entradas):
+    """Quita de la cola las primeras entradas, ya aplicadas o descartadas"""
+    with _lock:
+        for entrada in entradas:
+            _pendientes.popleft()
+            if entrada.get('clave'):
+                _respuestas.pop((entrada['usuario_id'], entrada['clave']), None)
+        # Todo resuelto: el registro vuelve a empezar
+        if not _pendientes:
+            os.ftruncate(_archivo, 0)
+
+
+def _vaciar():
+    """Aplica lo pendiente lote a lote; False si la base de datos no está disponible"""
+    lote = current_app.config.get('INGESTA_LOTE_MAX', 500)
+    with _lock_vaciado:
+        while True:
+            with _lock:
+                entradas = list(islice(_pendientes, lote))
+            if not entradas:
+                return True
+            try:
+                _aplicar_o_descartar(entradas, _retirar)
+            except OperationalError:
+                current_app.logger.exception('Ingesta: base de datos no disponible; se reintenta el lote')
+                return False
+            finally:
+                db.session.remove()
+
+
+def _escritor(app):
+    intervalo = app.config.get('INGESTA_INTERVALO_MS', 20) / 1000
+    lote = app.config.get('INGESTA_LOTE_MAX', 500)
+    while True:
+        _aviso.wait()
+        # Se espera un poco para juntar los escaneos que llegan seguidos
+        if len(_pendientes) < lote:
+            time.sleep(intervalo)
+        _aviso.clear()
+        with app.app_context():
+            if not _vaciar():
+                # El registro conserva el lote; se reintenta en un momento
+                time.sleep(1)
+                _aviso.set()
+
+
+def detener():
+    """Aplica lo pendiente y borra el registro; se llama al terminar el worker"""
+    global _archivo
+    if _hilo is None or _archivo is None:
+        return
+    if _vaciar():
+        with _lock:
+            os.close(_archivo)
+            _archivo = None
+            os.remove(_ruta)
@@ -0,0 +1,201 @@
+"""Exportaciones pesadas en segundo plano.
+
+Cada trabajo se identifica por un hash de su formato, sus parámetros y la
+versión de las tablas que lee, de modo que peticiones idénticas comparten
+el mismo archivo mientras los datos no cambien. El estado vive en un
+JSON junto al archivo en CACHE_DIR/exportaciones, así que cualquier worker
+puede informar el progreso o servir la descarga.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from datetime import date
+from extensions import db
+from services import badges, exports, memo
+import hashlib
+import json
+import os
+import threading
+import time
+
+# formato -> (función que escribe el archivo, extensión, mimetype)
+FORMATOS = {
+    'csv': (exports.escribir_csv, 'csv', 'text/csv'),
+    'pdf': (exports.generar_pdf, 'pdf', 'application/pdf'),
+    'xlsx': (exports.generar_xlsx, 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'carnets': (badges.generar_pdf, 'pdf', 'application/pdf'),
+}
+
+# Tablas que lee cada formato: un cambio en ellas genera un trabajo nuevo
+DEPENDENCIAS = {
+    'csv': ('asistencias', 'estudiantes'),
+    'pdf': ('asistencias', 'estudiantes'),
+    'xlsx': ('asistencias', 'estudiantes'),
+    'carnets': ('estudiantes',),
+}
+
+# Formatos que solo puede pedir un administrador
+FORMATOS_ADMIN = {'carnets'}
+
+PENDIENTE = 'pendiente'
+EN_PROCESO = 'en_proceso'
+LISTO = 'listo'
+ERROR = 'error'
+
+_lock = threading.Lock()
+_executor = None
+_ultima_limpieza = 0.0
+
+
+def _directorio():
+    directorio = os.path.join(current_app.config['CACHE_DIR'], 'exportaciones')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _ruta_estado(job_id):
+    return os.path.join(_directorio(), f'{job_id}.json')
+
+
+def ruta_archivo(estado):
+    return os.path.join(_directorio(), estado['archivo'])
+
+
+def _vigencia():
+    return current_app.config.get('EXPORTACIONES_TTL', 3600)
+
+
+def _escribir_estado(job_id, estado):
+    ruta = _ruta_estado(job_id)
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporal, 'w') as archivo:
+        json.dump(estado, archivo)
+    os.replace(temporal, ruta)
+
+
+def obtener(job_id):
+    """Estado del trabajo, o None si no existe o ya expiró"""
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_ruta_estado(job_id)) as archivo:
+            estado = json.load(archivo)
+    except (FileNotFoundError, ValueError):
+        return None
+    if time.time() - estado['creado'] > _vigencia():
+        return None
+    return estado
+
+
+def _id_trabajo(formato, parametros):
+    firma = json.dumps({
+        'formato': formato,
+        'parametros': parametros,
+        'versiones': memo.versiones(DEPENDENCIAS.get(formato, ()))
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(firma.encode()).hexdigest()[:32]
+
+
+def _abandonado(estado):
+    """Trabajo en curso cuyo worker dejó de informar progreso"""
+    limite = current_app.config.get('EXPORTACIONES_ABANDONO', 600)
+    return estado['estado'] in (PENDIENTE, EN_PROCESO) and time.time() - estado['actualizado'] > limite
+
+
+def enviar(formato, **parametros):
+    """Encola una exportación y devuelve su estado; reutiliza la existente si es idéntica"""
+    funcion, extension, mimetype = FORMATOS[formato]
+    if parametros.get('comprimir'):
+        extension, mimetype = f'{extension}.gz', 'application/gzip'
+    job_id = _id_trabajo(formato, parametros)
+    limpiar()
+
+    with _lock:
+        estado = obtener(job_id)
+        if estado is not None and estado['estado'] != ERROR and not _abandonado(estado):
+            return estado
+
+        ahora = time.time()
+        estado = {
+            'id': job_id,
+            'formato': formato,
+            'estado': PENDIENTE,
+            'progreso': 0,
+            'archivo': f'{job_id}.{extension}',
+            'mimetype': mimetype,
+            'creado': ahora,
+            'actualizado': ahora,
+            'error': None
+        }
+        _escribir_estado(job_id, estado)
+
+    app = current_app._get_current_object()
+    _pool(app).submit(_ejecutar, app, job_id, funcion, parametros)
+    return estado
+
+
+def _pool(app):
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('EXPORTACIONES_HILOS', 2),
+                thread_name_prefix='exportacion'
+            )
+        return _executor
+
+
+def _ejecutar(app, job_id, funcion, parametros):
+    with app.app_context():
+        estado = obtener(job_id)
+        if estado is None:
+            # El estado expiró o lo borró limpiar antes de que el trabajo arrancara
+            current_app.logger.warning('Exportación %s sin estado; se omite', job_id)
+            return
+        estado['estado'] = EN_PROCESO
+        _escribir_estado(job_id, estado)
+
+        def progreso(filas):
+            estado['progreso'] = filas
+            estado['actualizado'] = time.time()
+            _escribir_estado(job_id, estado)
+
+        destino = ruta_archivo(estado)
+        temporal = f'{destino}.{os.getpid()}.tmp'
+        try:
+            argumentos = {
+                clave: date.fromisoformat(valor) if clave.startswith('fecha_') and valor else valor
+                for clave, valor in parametros.items()
+            }
+            with open(temporal, 'wb') as archivo:
+                funcion(archivo, progreso=progreso, **argumentos)
+            os.replace(temporal, destino)
+            estado['estado'] = LISTO
+        except Exception as e:
+            current_app.logger.exception('Error en la exportación %s', job_id)
+            estado['estado'] = ERROR
+            estado['error'] = str(e)
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        finally:
+            db.session.remove()
+        estado['actualizado'] = time.time()
+        _escribir_estado(job_id, estado)
+
+
+def limpiar():
+    """Borra archivos y estados expirados, como mucho una vez por minuto por worker"""
+    global _ultima_limpieza
+    ahora = time.time()
+    if ahora - _ultima_limpieza < 60:
+        return
+    _ultima_limpieza = ahora
+
+    directorio = _directorio()
+    # Los temporales de trabajos en curso se renuevan; los huérfanos caducan igual
+    for nombre in os.listdir(directorio):
+        ruta = os.path.join(directorio, nombre)
+        try:
+            if ahora - os.path.getmtime(ruta) > _vigencia():
+                os.remove(ruta)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,140 @@
+"""Contadores del día en vivo para los dashboards (Server-Sent Events).
+
+Un hilo por worker vigila las versiones de las tablas asistencias,
+resumen_asistencias y estudiantes; cuando alguna cambia recalcula los
+contadores una sola vez y despierta a todas las pantallas conectadas, que
+reciben el mismo mensaje ya serializado. Diez dashboards abiertos cuestan lo mismo que uno.
+"""
+from flask import current_app
+from extensions import db
+from models import Asistencia, Estudiante, ResumenAsistencia
+from services import memo, roster
+from services.attendance import TIPOS_COMIDA
+from datetime import date
+from sqlalchemy import func
+import json
+import threading
+import time
+
+TABLAS = ('asistencias', 'resumen_asistencias', 'estudiantes')
+
+_cambio = threading.Condition()
+_hilo = None
+_secuencia = 0
+_datos = None
+_mensaje = None
+
+
+def _firma():
+    return memo.versiones(TABLAS) + (date.today(),)
+
+
+def _contadores():
+    hoy = date.today()
+    por_tipo = dict.fromkeys(TIPOS_COMIDA, 0)
+    por_tipo_estudiante = {'becado': 0, 'pagado': 0}
+    filas = db.session.query(
+        ResumenAsistencia.tipo,
+        ResumenAsistencia.tipo_estudiante,
+        func.sum(ResumenAsistencia.total)
+    ).filter(ResumenAsistencia.fecha == hoy).group_by(
+        ResumenAsistencia.tipo,
+        ResumenAsistencia.tipo_estudiante
+    )
+    for tipo, tipo_estudiante, total in filas:
+        por_tipo[tipo] = por_tipo.get(tipo, 0) + total
+        por_tipo_estudiante[tipo_estudiante] = por_tipo_estudiante.get(tipo_estudiante, 0) + total
+
+    ultimas = db.session.query(
+        Asistencia.hora,
+        Asistencia.tipo,
+        Estudiante.nombre,
+        Estudiante.curso,
+        Estudiante.tipo_estudiante
+    ).join(Estudiante).order_by(Asistencia.fecha.desc(), Asistencia.hora.desc()).limit(5)
+
+    total = sum(por_tipo.values())
+    activos = sum(1 for estudiante in roster.todos() if estudiante.estado)
+    return {
+        'fecha': hoy.isoformat(),
+        'total': total,
+        'estudiantes_activos': activos,
+        'porcentaje': round(total / activos * 100) if activos else 0,
+        'por_tipo': por_tipo,
+        'por_tipo_estudiante': por_tipo_estudiante,
+        'ultimas': [
+            {
+                'hora': fila.hora.strftime('%H:%M'),
+                'tipo': fila.tipo,
+                'nombre': fila.nombre,
+                'curso': fila.curso,
+                'tipo_estudiante': fila.tipo_estudiante
+            }
+            for fila in ultimas
+        ]
+    }
+
+
+def _publicar(datos):
+    global _secuencia, _datos, _mensaje
+    with _cambio:
+        _secuencia += 1
+        _datos = datos
+        _mensaje = f'id: {_secuencia}\nevent: contadores\ndata: {datos}\n\n'
+        _cambio.notify_all()
+
+
+def _publicador(app, firma):
+    intervalo = app.config.get('EN_VIVO_INTERVALO', 1.0)
+    while True:
+        time.sleep(intervalo)
+        with app.app_context():
+            nueva = _firma()
+            if nueva == firma:
+                continue
+            try:
+                _publicar(json.dumps(_contadores()))
+                firma = nueva
+            except Exception:
+                current_app.logger.exception('Error al calcular los contadores en vivo')
+            finally:
+                db.session.remove()
+
+
+def iniciar():
+    """Calcula los contadores y arranca el publicador de este worker, si no corre ya"""
+    global _hilo
+    if _hilo is not None:
+        return
+    with _cambio:
+        if _hilo is not None:
+            return
+        firma = _firma()
+        _publicar(json.dumps(_contadores()))
+        app = current_app._get_current_object()
+        _hilo = threading.Thread(target=_publicador, args=(app, firma), name='en_vivo', daemon=True)
+        _hilo.start()
+
+
+def actuales():
+    """Último JSON publicado, para quien consulta sin mantener la conexión"""
+    iniciar()
+    return _datos
+
+
+def flujo(duracion, latido=15):
+    """Generador del stream de eventos; se cierra tras `duracion` segundos y el navegador reconecta"""
+    iniciar()
+    limite = time.monotonic() + duracion
+    enviada = None
+    yield 'retry: 2000\n\n'
+    while time.monotonic() < limite:
+        with _cambio:
+            if _secuencia == enviada:
+                _cambio.wait(timeout=latido)
+            secuencia, mensaje = _secuencia, _mensaje
+        if secuencia != enviada:
+            enviada = secuencia
+            yield mensaje
+        else:
+            yield ': latido\n\n'
@@ -0,0 +1,221 @@
+"""Memoización de consultas agregadas, invalidada por versión de tabla.
+
+Cada resultado se guarda bajo el nombre de la consulta y sus argumentos, y
+queda etiquetado con las tablas de las que depende. Todo commit que
+inserta, modifica o borra filas de una tabla incrementa su sello
+'tabla.<nombre>' (eventos de la sesión), lo que invalida en todos los
+workers los resultados que dependen de ella.
+
+Hay dos niveles: un LRU en memoria por worker (MEMO_MAX_ENTRADAS) y un
+almacén en disco compartido en CACHE_DIR/memo (MEMO_DISCO_MAX_BYTES). Un
+resultado que falta se calcula una sola vez aunque lo pidan a la vez varios
+usuarios o workers: el cálculo se serializa con un bloqueo de archivo.
+"""
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app
+from extensions import db
+from services import versions
+from sqlalchemy import event
+import fcntl
+import hashlib
+import os
+import pickle
+import threading
+
+PREFIJO = 'tabla.'
+
+_FALTA = object()
+_lock = threading.Lock()
+_memoria = OrderedDict()
+_contadores = {}
+_escrituras = 0
+
+
+def sello(tabla):
+    return PREFIJO + tabla
+
+
+def versiones(tablas):
+    """Versión actual de cada tabla; cambia con cada commit que la modifica"""
+    return tuple(versions.actual(sello(tabla)) for tabla in tablas)
+
+
+# Registro de las tablas modificadas en cada transacción
+
+def _anotar(session, tablas):
+    session.info.setdefault('tablas_modificadas', set()).update(tablas)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _despues_de_flush(session, contexto):
+    objetos = (*session.new, *session.dirty, *session.deleted)
+    _anotar(session, {objeto.__table__.name for objeto in objetos if hasattr(objeto, '__table__')})
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _al_ejecutar(estado):
+    # insert/update/delete masivos, que no pasan por el flush
+    if estado.is_insert or estado.is_update or estado.is_delete:
+        tabla = getattr(estado.statement, 'table', None)
+        if tabla is not None:
+            _anotar(estado.session, {tabla.name})
+
+
+@event.listens_for(db.session, 'after_commit')
+def _despues_de_commit(session):
+    for tabla in session.info.pop('tablas_modificadas', ()):
+        versions.incrementar(sello(tabla))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _despues_de_rollback(session):
+    session.info.pop('tablas_modificadas', None)
+
+
+# Resultados memoizados
+
+def _directorio():
+    directorio = os.path.join(current_app.config['CACHE_DIR'], 'memo')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def _clave(nombre, args, kwargs):
+    return hashlib.sha1(repr((nombre, args, sorted(kwargs.items()))).encode()).hexdigest()
+
+
+def _contar(nombre, origen):
+    with _lock:
+        _contadores.setdefault(nombre, Counter())[origen] += 1
+
+
+def _recordar(clave, version, valor):
+    limite = current_app.config.get('MEMO_MAX_ENTRADAS', 256)
+    with _lock:
+        _memoria[clave] = (version, valor)
+        _memoria.move_to_end(clave)
+        while len(_memoria) > limite:
+            _memoria.popitem(last=False)
+
+
+def _leer(ruta, version):
+    try:
+        with open(ruta, 'rb') as archivo:
+            guardada, valor = pickle.load(archivo)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return _FALTA
+    if guardada != version:
+        return _FALTA
+    os.utime(ruta)
+    return valor
+
+
+def _escribir(ruta, version, valor):
+    global _escrituras
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporal, 'wb') as archivo:
+        pickle.dump((version, valor), archivo, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporal, ruta)
+
+    _escrituras += 1
+    if _escrituras % 100 == 0:
+        recortar()
+
+
+@contextmanager
+def _bloqueo(clave):
+    # 256 archivos de bloqueo repartidos por el prefijo de la clave
+    with open(os.path.join(_directorio(), f'{clave[:2]}.lock'), 'a') as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def obtener(nombre, tablas, funcion, *args, **kwargs):
+    """Resultado de funcion(*args, **kwargs), calculado solo si cambió alguna de las tablas.
+
+    El resultado debe poder serializarse con pickle: filas convertidas a
+    tuplas o diccionarios, nunca objetos del ORM.
+    """
+    clave = _clave(nombre, args, kwargs)
+    version = versiones(tablas)
+    with _lock:
+        entrada = _memoria.get(clave)
+        if entrada is not None and entrada[0] == version:
+            _memoria.move_to_end(clave)
+            _contadores.setdefault(nombre, Counter())['memoria'] += 1
+            return entrada[1]
+
+    ruta = os.path.join(_directorio(), f'{clave}.pickle')
+    origen = 'disco'
+    valor = _leer(ruta, version)
+    if valor is _FALTA:
+        with _bloqueo(clave):
+            # Otro worker pudo calcularlo mientras se esperaba el bloqueo
+            valor = _leer(ruta, version)
+            if valor is _FALTA:
+                valor = funcion(*args, **kwargs)
+                _escribir(ruta, version, valor)
+                origen = 'calculos'
+
+    _contar(nombre, origen)
+    _recordar(clave, version, valor)
+    return valor
+
+
+def cacheado(nombre, tablas):
+    """Decorador: memoiza la función bajo `nombre`, dependiente de `tablas`"""
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            return obtener(nombre, tablas, funcion, *args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def estadisticas():
+    """Aciertos y cálculos por consulta en este worker"""
+    with _lock:
+        consultas = {}
+        for nombre, conteo in sorted(_contadores.items()):
+            total = sum(conteo.values())
+            consultas[nombre] = {
+                'memoria': conteo['memoria'],
+                'disco': conteo['disco'],
+                'calculos': conteo['calculos'],
+                'tasa_aciertos': round((conteo['memoria'] + conteo['disco']) / total, 3) if total else 0
+            }
+        return {'pid': os.getpid(), 'entradas_memoria': len(_memoria), 'consultas': consultas}
+
+
+def recortar():
+    """Borra los resultados en disco usados hace más tiempo hasta quedar bajo el límite"""
+    limite = current_app.config.get('MEMO_DISCO_MAX_BYTES', 20 * 1024 * 1024)
+    archivos = []
+    total = 0
+    with os.scandir(_directorio()) as entradas:
+        for entrada in entradas:
+            if not entrada.name.endswith('.pickle'):
+                continue
+            try:
+                estado = entrada.stat()
+            except FileNotFoundError:
+                continue
+            archivos.append((estado.st_mtime, estado.st_size, entrada.path))
+            total += estado.st_size
+
+    if total <= limite:
+        return
+    archivos.sort()
+    for _, tamano, archivo in archivos:
+        try:
+            os.remove(archivo)
+        except FileNotFoundError:
+            pass
+        total -= tamano
+        if total <= limite:
+            break
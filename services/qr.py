@@ -0,0 +1,132 @@
+"""Imágenes QR de los carnés, guardadas en disco.
+
+Cada imagen se nombra por el hash de su contenido (identificador, formato y
+parámetros de dibujo), así que sirve de ETag fuerte y solo cambia cuando
+cambia el identificador. El directorio se recorta por LRU (fecha de último
+acceso) cuando supera QR_CACHE_MAX_BYTES.
+"""
+from flask import current_app
+import hashlib
+import io
+import os
+import qrcode
+import qrcode.image.svg
+import threading
+import time
+
+FORMATOS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml'
+}
+
+# Cambiar si cambian los parámetros de dibujo, para no servir imágenes viejas
+VERSION_DIBUJO = 1
+TAMANO_MODULO = 10
+BORDE = 4
+
+# Cada cuántas imágenes nuevas se revisa el tamaño del directorio
+ESCRITURAS_POR_RECORTE = 200
+# Un acceso renueva la fecha de uso como mucho una vez por este intervalo
+RENOVAR_CADA = 3600
+
+_lock = threading.Lock()
+_escrituras = 0
+
+
+def directorio():
+    carpeta = os.path.join(current_app.config['CACHE_DIR'], 'qr')
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def etag(identificador, formato, tamano_modulo=TAMANO_MODULO):
+    firma = f'{VERSION_DIBUJO}|{tamano_modulo}|{BORDE}|{formato}|{identificador}'
+    return hashlib.sha256(firma.encode()).hexdigest()[:32]
+
+
+def dibujar(identificador, formato='png', tamano_modulo=TAMANO_MODULO):
+    """Codifica el identificador y devuelve los bytes de la imagen"""
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=tamano_modulo,
+        border=BORDE
+    )
+    qr.add_data(identificador)
+    qr.make(fit=True)
+
+    buffer = io.BytesIO()
+    if formato == 'svg':
+        qr.make_image(image_factory=qrcode.image.svg.SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color='black', back_color='white').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def ruta(carpeta, identificador, formato='png', tamano_modulo=TAMANO_MODULO):
+    return os.path.join(carpeta, f'{etag(identificador, formato, tamano_modulo)}.{formato}')
+
+
+def asegurar(carpeta, identificador, formato='png', tamano_modulo=TAMANO_MODULO):
+    """Dibuja la imagen en la carpeta si falta y devuelve (ruta, creada).
+
+    No usa la aplicación, así que puede correr en otro proceso.
+    """
+    destino = ruta(carpeta, identificador, formato, tamano_modulo)
+    try:
+        estado = os.stat(destino)
+    except FileNotFoundError:
+        temporal = f'{destino}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporal, 'wb') as archivo:
+            archivo.write(dibujar(identificador, formato, tamano_modulo))
+        os.replace(temporal, destino)
+        return destino, True
+
+    if time.time() - estado.st_atime > RENOVAR_CADA:
+        os.utime(destino)
+    return destino, False
+
+
+def obtener(identificador, formato='png'):
+    """Devuelve (ruta, etag) de la imagen, dibujándola solo si no está en disco"""
+    if formato not in FORMATOS:
+        raise ValueError('Formato de imagen no válido')
+    destino, creada = asegurar(directorio(), identificador, formato)
+    if creada:
+        _contar_escritura()
+    return destino, etag(identificador, formato)
+
+
+def _contar_escritura():
+    global _escrituras
+    with _lock:
+        _escrituras += 1
+        recortar_ahora = _escrituras % ESCRITURAS_POR_RECORTE == 1
+    if recortar_ahora:
+        recortar()
+
+
+def recortar():
+    """Borra las imágenes usadas hace más tiempo hasta quedar bajo el límite"""
+    limite = current_app.config.get('QR_CACHE_MAX_BYTES', 50 * 1024 * 1024)
+    archivos = []
+    total = 0
+    with os.scandir(directorio()) as entradas:
+        for entrada in entradas:
+            try:
+                estado = entrada.stat()
+            except FileNotFoundError:
+                continue
+            archivos.append((max(estado.st_atime, estado.st_mtime), estado.st_size, entrada.path))
+            total += estado.st_size
+
+    if total <= limite:
+        return
+    archivos.sort()
+    for _, tamano, archivo in archivos:
+        try:
+            os.remove(archivo)
+        except FileNotFoundError:
+            pass
+        total -= tamano
+        if total <= limite:
+            break
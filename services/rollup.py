@@ -0,0 +1,147 @@
+"""Mantenimiento de resumen_asistencias, el conteo diario que leen los dashboards.
+
+Cada escaneo suma con el curso y el tipo del estudiante en ese momento;
+cuando se le cambia alguno, reubicar recalcula los días en que tiene
+asistencias para que el resumen coincida con una reconstrucción.
+"""
+from collections import Counter
+from extensions import db
+from models import Estudiante, Asistencia, ResumenAsistencia
+from services import memo, roster, versions
+from services.sql import insert_dialecto
+from datetime import date, timedelta
+from sqlalchemy import func, insert, select
+
+CLAVE = ['fecha', 'tipo', 'curso', 'tipo_estudiante', 'metodo_registro']
+
+
+def _clave(fila):
+    estudiante = roster.obtener(fila['estudiante_id'])
+    if estudiante is None:
+        estudiante = db.session.get(Estudiante, fila['estudiante_id'])
+    return (
+        fila['fecha'],
+        fila['tipo'],
+        estudiante.curso,
+        estudiante.tipo_estudiante,
+        fila.get('metodo_registro') or ''
+    )
+
+
+def sumar(filas):
+    """Suma al resumen las asistencias recién insertadas. No hace commit."""
+    conteos = Counter(_clave(fila) for fila in filas)
+    if not conteos:
+        return
+
+    valores = [dict(zip(CLAVE, clave), total=total) for clave, total in conteos.items()]
+    insert_conflictos = insert_dialecto()
+    if insert_conflictos is not None:
+        sentencia = insert_conflictos(ResumenAsistencia).values(valores)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=CLAVE,
+            set_={'total': ResumenAsistencia.total + sentencia.excluded.total}
+        )
+        db.session.execute(sentencia)
+        return
+
+    for valor in valores:
+        resumen = db.session.get(ResumenAsistencia, tuple(valor[c] for c in CLAVE))
+        if resumen is None:
+            db.session.add(ResumenAsistencia(**valor))
+        else:
+            resumen.total += valor['total']
+
+
+def _recalcular(desde=None, hasta=None, fechas=None):
+    """Borra y vuelve a calcular el resumen de las fechas indicadas. No hace commit."""
+    borrar = ResumenAsistencia.query
+    consulta = select(
+        Asistencia.fecha,
+        Asistencia.tipo,
+        Estudiante.curso,
+        Estudiante.tipo_estudiante,
+        func.coalesce(Asistencia.metodo_registro, ''),
+        func.count(Asistencia.id)
+    ).join(Estudiante, Asistencia.estudiante_id == Estudiante.id)
+
+    if desde:
+        borrar = borrar.filter(ResumenAsistencia.fecha >= desde)
+        consulta = consulta.where(Asistencia.fecha >= desde)
+    if hasta:
+        borrar = borrar.filter(ResumenAsistencia.fecha <= hasta)
+        consulta = consulta.where(Asistencia.fecha <= hasta)
+    if fechas is not None:
+        borrar = borrar.filter(ResumenAsistencia.fecha.in_(fechas))
+        consulta = consulta.where(Asistencia.fecha.in_(fechas))
+
+    consulta = consulta.group_by(
+        Asistencia.fecha,
+        Asistencia.tipo,
+        Estudiante.curso,
+        Estudiante.tipo_estudiante,
+        func.coalesce(Asistencia.metodo_registro, '')
+    )
+
+    borrar.delete(synchronize_session=False)
+    db.session.execute(
+        insert(ResumenAsistencia).from_select(CLAVE + ['total'], consulta)
+    )
+
+
+def reconstruir(desde=None, hasta=None):
+    """Recalcula el resumen a partir de asistencias (rango de fechas inclusivo) y hace commit"""
+    _recalcular(desde, hasta)
+    db.session.commit()
+    # Las sentencias masivas ya marcan la tabla; se incrementa aunque no haya filas
+    versions.incrementar(memo.sello('resumen_asistencias'))
+
+
+def reubicar(estudiante_id):
+    """Recalcula los días con asistencias del estudiante tras cambiarle curso o tipo. No hace commit."""
+    db.session.flush()
+    _recalcular(fechas=select(Asistencia.fecha).where(Asistencia.estudiante_id == estudiante_id).distinct())
+
+
+@memo.cacheado('rollup.resumen_mensual', tablas=('resumen_asistencias',))
+def resumen_mensual(anio, mes):
+    """Totales del mes en una sola consulta sobre el rango [inicio, fin)"""
+    inicio = date(anio, mes, 1)
+    fin = date(anio + 1, 1, 1) if mes == 12 else date(anio, mes + 1, 1)
+
+    filas = db.session.query(
+        ResumenAsistencia.fecha,
+        ResumenAsistencia.curso,
+        ResumenAsistencia.tipo_estudiante,
+        func.sum(ResumenAsistencia.total)
+    ).filter(
+        ResumenAsistencia.fecha >= inicio,
+        ResumenAsistencia.fecha < fin
+    ).group_by(
+        ResumenAsistencia.fecha,
+        ResumenAsistencia.curso,
+        ResumenAsistencia.tipo_estudiante
+    ).all()
+
+    por_dia = {inicio + timedelta(days=i): 0 for i in range((fin - inicio).days)}
+    por_curso = {}
+    por_tipo = Counter()
+    for fecha, curso, tipo_estudiante, total in filas:
+        por_dia[fecha] += total
+        por_tipo[tipo_estudiante] += total
+        conteo = por_curso.setdefault(curso, {'nombre': curso, 'total': 0, 'becados': 0, 'pagados': 0})
+        conteo['total'] += total
+        if tipo_estudiante == 'becado':
+            conteo['becados'] += total
+        elif tipo_estudiante == 'pagado':
+            conteo['pagados'] += total
+
+    resultado = {
+        'total_asistencias': sum(por_tipo.values()),
+        'total_becados': por_tipo['becado'],
+        'total_pagados': por_tipo['pagado'],
+        'dias': [fecha.strftime('%d/%m') for fecha in por_dia],
+        'asistencias_por_dia': list(por_dia.values()),
+        'asistencias_por_curso': [por_curso[curso] for curso in sorted(por_curso)]
+    }
+    return resultado
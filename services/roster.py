@@ -0,0 +1,94 @@
+"""Caché en memoria del padrón de estudiantes, por worker.
+
+Guarda solo lo que necesita el escaneo (unos 350 bytes por estudiante) y se
+recarga cuando cambia el sello de versión 'estudiantes'.
+"""
+from collections import namedtuple
+from extensions import db
+from models import Estudiante
+from services import versions
+import sys
+import threading
+
+EstudianteRoster = namedtuple(
+    'EstudianteRoster', 'id identificador nombre curso tipo_estudiante estado'
+)
+
+PREFIJO_QR = 'STUDENT:'
+
+_lock = threading.Lock()
+_version = object()
+_por_id = {}
+_por_identificador = {}
+
+
+def precargar():
+    """Carga el padrón completo; se llama al arrancar cada worker"""
+    with _lock:
+        _cargar()
+
+
+def _cargar():
+    global _version, _por_id, _por_identificador
+    version = versions.actual('estudiantes')
+    por_id = {}
+    por_identificador = {}
+    filas = db.session.query(
+        Estudiante.id,
+        Estudiante.identificador,
+        Estudiante.nombre,
+        Estudiante.curso,
+        Estudiante.tipo_estudiante,
+        Estudiante.estado
+    ).yield_per(5000)
+    for fila in filas:
+        estudiante = EstudianteRoster(
+            fila.id,
+            fila.identificador,
+            fila.nombre,
+            sys.intern(fila.curso),
+            sys.intern(fila.tipo_estudiante),
+            bool(fila.estado)
+        )
+        por_id[estudiante.id] = estudiante
+        por_identificador[estudiante.identificador] = estudiante.id
+    _por_id, _por_identificador = por_id, por_identificador
+    _version = version
+
+
+def _vigente():
+    if versions.actual('estudiantes') != _version:
+        with _lock:
+            if versions.actual('estudiantes') != _version:
+                _cargar()
+
+
+def obtener(valor):
+    """Busca un estudiante por id (int), identificador o contenido del QR ('STUDENT:<id>').
+
+    Un texto de solo dígitos se busca como identificador, nunca como id:
+    lo escrito en el formulario no debe caer en otro estudiante.
+    """
+    _vigente()
+    if isinstance(valor, int):
+        return _por_id.get(valor)
+
+    valor = str(valor).strip()
+    if valor in _por_identificador:
+        return _por_id.get(_por_identificador[valor])
+    if valor.startswith(PREFIJO_QR):
+        valor = valor[len(PREFIJO_QR):]
+        if valor.isdigit():
+            return _por_id.get(int(valor))
+    return None
+
+
+def todos():
+    """Copia instantánea de los estudiantes en caché"""
+    _vigente()
+    return list(_por_id.values())
+
+
+def invalidar():
+    """Llamar después del commit de cualquier cambio en estudiantes"""
+    versions.incrementar('estudiantes')
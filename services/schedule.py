@@ -0,0 +1,78 @@
+"""Horario de comidas compilado: qué comida corresponde a cada minuto de la semana.
+
+Las ventanas de desayuno, almuerzo y cena, los días de servicio y el horario
+general se compilan en un bytearray de 7 * 1440 posiciones, una por minuto de
+la semana. Saber a qué comida pertenece un escaneo es un acceso por índice.
+Se recompila cuando cambia la configuración.
+"""
+from flask import current_app
+from services import attendance, settings
+import threading
+
+MINUTOS_DIA = 24 * 60
+
+_lock = threading.Lock()
+_version = object()
+_horario = bytearray(7 * MINUTOS_DIA)
+
+
+def _minuto(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def _compilar(version):
+    """Cada posición vale 0 (cerrado) o 1 + el índice de la comida en TIPOS_COMIDA"""
+    global _version, _horario
+    valores = settings.todos()
+    general = range(_minuto(valores['hora_inicio']), _minuto(valores['hora_fin']))
+
+    dia = bytearray(MINUTOS_DIA)
+    for indice, tipo in enumerate(attendance.TIPOS_COMIDA):
+        inicio, fin = _minuto(valores[f'{tipo}_inicio']), _minuto(valores[f'{tipo}_fin'])
+        if fin <= inicio:
+            current_app.logger.warning('Horario de %s vacío o invertido; la comida queda cerrada', tipo)
+            continue
+        for minuto in range(inicio, fin):
+            # Si dos ventanas se solapan gana la comida anterior
+            if minuto in general and not dia[minuto]:
+                dia[minuto] = indice + 1
+
+    horario = bytearray(7 * MINUTOS_DIA)
+    for numero in valores['dias_servicio']:
+        horario[numero * MINUTOS_DIA:(numero + 1) * MINUTOS_DIA] = dia
+    _horario = horario
+    _version = version
+
+
+def _vigente():
+    version = settings.version()
+    if version is not _version:
+        with _lock:
+            if version is not _version:
+                _compilar(version)
+    return _horario
+
+
+def comida_en(fecha, hora):
+    """Comida que se sirve en ese momento, o None si está fuera de horario"""
+    posicion = _vigente()[fecha.weekday() * MINUTOS_DIA + _minuto(hora)]
+    return attendance.TIPOS_COMIDA[posicion - 1] if posicion else None
+
+
+def resolver(tipo, fecha, hora):
+    """Devuelve (tipo, None) con la comida que corresponde, o (None, mensaje de error).
+
+    Sin tipo se asigna la comida del horario. Con tipo, se exige que sea su
+    horario salvo que la configuración 'horario_estricto' esté desactivada.
+    """
+    actual = comida_en(fecha, hora)
+    if not tipo:
+        if actual is None:
+            return None, 'Fuera del horario de servicio'
+        return actual, None
+
+    if tipo not in attendance.TIPOS_COMIDA:
+        return None, 'Tipo de comida no válido'
+    if tipo != actual and settings.obtener('horario_estricto'):
+        return None, f'Fuera del horario de {tipo}'
+    return tipo, None
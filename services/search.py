@@ -0,0 +1,143 @@
+"""Índice de búsqueda de estudiantes en memoria, por worker.
+
+Se construye a partir del padrón en caché (solo estudiantes activos) sobre
+textos normalizados: sin tildes y en minúsculas. Cada campo tiene un índice
+de trigramas; las consultas de menos de tres caracteres recorren la lista
+normalizada, que sigue siendo mucho más barato que un ilike sobre la tabla.
+"""
+from array import array
+from services import roster, versions
+import base64
+import heapq
+import threading
+import unicodedata
+
+CAMPOS = ('identificador', 'nombre', 'curso')
+
+LIMITE_MAXIMO = 100
+
+_lock = threading.Lock()
+_version = object()
+_indices = {}
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'José Peña' -> 'jose pena'"""
+    descompuesto = unicodedata.normalize('NFKD', str(texto or ''))
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower().strip()
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class _IndiceCampo:
+    """Trigramas -> posiciones de estudiantes cuyo texto los contiene"""
+
+    def __init__(self, estudiantes, nombres, campo):
+        self.estudiantes = estudiantes
+        self.nombres = nombres
+        self.textos = nombres if campo == 'nombre' else [normalizar(getattr(e, campo)) for e in estudiantes]
+        trigramas = {}
+        for posicion, texto in enumerate(self.textos):
+            for trigrama in _trigramas(texto):
+                trigramas.setdefault(trigrama, array('I')).append(posicion)
+        self.trigramas = trigramas
+
+    def candidatos(self, consulta):
+        if len(consulta) < 3:
+            return range(len(self.textos))
+        listas = []
+        for trigrama in _trigramas(consulta):
+            posiciones = self.trigramas.get(trigrama)
+            if posiciones is None:
+                return ()
+            listas.append(posiciones)
+        listas.sort(key=len)
+        resultado = set(listas[0])
+        for posiciones in listas[1:]:
+            resultado.intersection_update(posiciones)
+            if not resultado:
+                break
+        return resultado
+
+    def buscar(self, consulta):
+        """(rango, nombre normalizado, id, estudiante) de cada coincidencia"""
+        for posicion in self.candidatos(consulta):
+            texto = self.textos[posicion]
+            inicio = texto.find(consulta)
+            if inicio < 0:
+                continue
+            # 0 exacto, 1 al inicio, 2 al inicio de una palabra, 3 en medio
+            if texto == consulta:
+                rango = 0
+            elif inicio == 0:
+                rango = 1
+            elif texto[inicio - 1] == ' ' or f' {consulta}' in texto:
+                rango = 2
+            else:
+                rango = 3
+            estudiante = self.estudiantes[posicion]
+            yield rango, self.nombres[posicion], estudiante.id, estudiante
+
+
+def precargar():
+    """Construye el índice; se llama al arrancar cada worker, después del padrón"""
+    _vigente()
+
+
+def _vigente():
+    version = versions.actual('estudiantes')
+    if version != _version:
+        with _lock:
+            if version != _version:
+                _construir(version)
+
+
+def _construir(version):
+    global _version, _indices
+    activos = [e for e in roster.todos() if e.estado]
+    nombres = [normalizar(e.nombre) for e in activos]
+    _indices = {campo: _IndiceCampo(activos, nombres, campo) for campo in CAMPOS}
+    _version = version
+
+
+def codificar_cursor(clave):
+    rango, nombre, estudiante_id = clave
+    valor = f'{rango}|{estudiante_id}|{nombre}'
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (rango, nombre, id); lanza ValueError si el cursor no es válido"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        rango, estudiante_id, nombre = base64.urlsafe_b64decode(cursor + relleno).decode().split('|', 2)
+        return int(rango), nombre, int(estudiante_id)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError('Cursor no válido') from e
+
+
+def buscar(valor, campo='identificador', limite=20, cursor=None):
+    """Devuelve (estudiantes, siguiente_cursor), ordenados por relevancia y nombre.
+
+    Lanza ValueError si el campo o el cursor no son válidos.
+    """
+    if campo not in CAMPOS:
+        raise ValueError('Tipo de búsqueda no válido')
+    consulta = normalizar(valor)
+    desde = decodificar_cursor(cursor) if cursor else None
+    limite = max(1, min(limite, LIMITE_MAXIMO))
+
+    _vigente()
+    coincidencias = heapq.nsmallest(
+        limite + 1,
+        (c for c in _indices[campo].buscar(consulta) if desde is None or c[:3] > desde),
+        key=lambda c: c[:3]
+    )
+
+    siguiente = None
+    if len(coincidencias) > limite:
+        coincidencias = coincidencias[:limite]
+        siguiente = codificar_cursor(coincidencias[-1][:3])
+    return [c[3] for c in coincidencias], siguiente
@@ -0,0 +1,51 @@
+"""Estudiantes ya servidos hoy, por tipo de comida, en memoria de cada worker.
+
+Permite rechazar escaneos duplicados sin consultar la base de datos. Solo
+conoce lo registrado por este worker y lo que había al sembrarse; las
+carreras con otros workers las resuelve el índice único de asistencias.
+"""
+from extensions import db
+from models import Asistencia
+import threading
+
+_lock = threading.Lock()
+_fecha = None
+_servidos = {}
+
+
+def _sembrar(fecha):
+    global _fecha, _servidos
+    servidos = {}
+    filas = db.session.query(Asistencia.estudiante_id, Asistencia.tipo).filter(
+        Asistencia.fecha == fecha
+    ).yield_per(5000)
+    for estudiante_id, tipo in filas:
+        servidos.setdefault(tipo, set()).add(estudiante_id)
+    _servidos = servidos
+    _fecha = fecha
+
+
+def _del_dia(fecha):
+    """Conjuntos del día indicado; al cambiar de día se vuelven a sembrar"""
+    if fecha != _fecha:
+        with _lock:
+            if fecha != _fecha:
+                _sembrar(fecha)
+    return _servidos
+
+
+def precargar(fecha):
+    with _lock:
+        _sembrar(fecha)
+
+
+def ya_servido(estudiante_id, tipo, fecha):
+    return estudiante_id in _del_dia(fecha).get(tipo, ())
+
+
+def marcar_servido(estudiante_id, tipo, fecha):
+    """Llamar después del commit del registro (o al detectar el duplicado)"""
+    servidos = _del_dia(fecha)
+    with _lock:
+        if fecha == _fecha:
+            servidos.setdefault(tipo, set()).add(estudiante_id)
@@ -0,0 +1,180 @@
+"""Registro de la tabla configuraciones, con valores tipados y caché por worker.
+
+Las claves conocidas se declaran en DEFINICIONES con su tipo y valor por
+defecto; se leen todas de una vez y se recargan cuando cambia el sello
+'configuracion'. Leer un valor no toca la base de datos.
+"""
+from collections import namedtuple
+from flask import current_app
+from extensions import db
+from models import Configuracion
+from services import versions
+from services.search import normalizar
+from services.sql import insert_dialecto
+from datetime import datetime
+import threading
+
+Definicion = namedtuple('Definicion', 'tipo defecto descripcion')
+
+DIAS_SEMANA = ('lunes', 'martes', 'miercoles', 'jueves', 'viernes', 'sabado', 'domingo')
+
+DEFINICIONES = {
+    'hora_inicio': Definicion('hora', '06:00', 'Hora de inicio del servicio'),
+    'hora_fin': Definicion('hora', '21:00', 'Hora de fin del servicio'),
+    'dias_servicio': Definicion('dias', 'lunes,martes,miercoles,jueves,viernes', 'Días de servicio'),
+    'desayuno_inicio': Definicion('hora', '06:30', 'Inicio del desayuno'),
+    'desayuno_fin': Definicion('hora', '09:30', 'Fin del desayuno'),
+    'almuerzo_inicio': Definicion('hora', '11:30', 'Inicio del almuerzo'),
+    'almuerzo_fin': Definicion('hora', '14:30', 'Fin del almuerzo'),
+    'cena_inicio': Definicion('hora', '17:30', 'Inicio de la cena'),
+    'cena_fin': Definicion('hora', '20:00', 'Fin de la cena'),
+    'horario_estricto': Definicion('booleano', '1', 'Rechazar registros fuera del horario de cada comida'),
+}
+
+_lock = threading.Lock()
+_version = object()
+_crudos = {}
+_valores = {}
+
+
+def _hora(valor):
+    return datetime.strptime(valor.strip(), '%H:%M:%S' if valor.count(':') == 2 else '%H:%M').time()
+
+
+def _dia(valor):
+    valor = normalizar(valor)
+    if valor.isdigit() and 1 <= int(valor) <= 7:
+        return int(valor) - 1  # 1 = lunes, como ISO
+    for numero, nombre in enumerate(DIAS_SEMANA):
+        if valor == nombre or (len(valor) >= 3 and nombre.startswith(valor)):
+            return numero
+    raise ValueError(f'Día no válido: {valor}')
+
+
+def _dias(valor):
+    """'lunes-viernes', 'lun,mie,vie' o '1,3,5' -> tupla de date.weekday()"""
+    dias = set()
+    for parte in valor.replace(';', ',').split(','):
+        if not parte.strip():
+            continue
+        if '-' in parte:
+            desde, hasta = (_dia(p) for p in parte.split('-', 1))
+            dias.update(range(desde, hasta + 1) if desde <= hasta else [*range(desde, 7), *range(hasta + 1)])
+        else:
+            dias.add(_dia(parte))
+    return tuple(sorted(dias))
+
+
+def _booleano(valor):
+    return normalizar(valor) in ('1', 'si', 'true', 'on')
+
+
+CONVERSORES = {
+    'texto': str.strip,
+    'entero': lambda valor: int(valor.strip()),
+    'hora': _hora,
+    'dias': _dias,
+    'booleano': _booleano,
+}
+
+
+def convertir(clave, valor):
+    """Valor tipado de una clave; lanza ValueError si el texto no es válido"""
+    definicion = DEFINICIONES.get(clave)
+    if definicion is None:
+        return valor
+    try:
+        return CONVERSORES[definicion.tipo](valor)
+    except ValueError as e:
+        raise ValueError(f'Valor no válido para {clave}: {valor}') from e
+
+
+def _cargar(version):
+    global _version, _crudos, _valores
+    crudos = {clave: d.defecto for clave, d in DEFINICIONES.items()}
+    crudos.update(db.session.query(Configuracion.clave, Configuracion.valor).all())
+
+    valores = {}
+    for clave, valor in crudos.items():
+        try:
+            valores[clave] = convertir(clave, valor)
+        except ValueError:
+            current_app.logger.warning('Configuración %s no válida (%r); se usa el valor por defecto', clave, valor)
+            valores[clave] = convertir(clave, DEFINICIONES[clave].defecto)
+    _crudos, _valores = crudos, valores
+    _version = version
+
+
+def _vigente():
+    version = versions.actual('configuracion')
+    if version != _version:
+        with _lock:
+            if version != _version:
+                _cargar(version)
+
+
+def version():
+    """Identifica la carga vigente; cambia cada vez que se recarga la configuración"""
+    _vigente()
+    return _version
+
+
+def obtener(clave, defecto=None):
+    """Valor tipado de la configuración"""
+    _vigente()
+    return _valores.get(clave, defecto)
+
+
+def todos():
+    """Copia de todos los valores tipados"""
+    _vigente()
+    return dict(_valores)
+
+
+def crudos():
+    """Copia de los valores tal como se guardan, para los formularios"""
+    _vigente()
+    return dict(_crudos)
+
+
+def guardar(valores):
+    """Valida y guarda varias claves en una sola sentencia, y hace commit.
+
+    Lanza ValueError, sin guardar nada, si algún valor no es válido.
+    """
+    filas = []
+    ahora = datetime.utcnow()
+    for clave, valor in valores.items():
+        valor = str(valor).strip()
+        convertir(clave, valor)
+        filas.append({
+            'clave': clave,
+            'valor': valor,
+            'descripcion': DEFINICIONES[clave].descripcion if clave in DEFINICIONES else None,
+            'fecha_modificacion': ahora
+        })
+    if not filas:
+        return
+
+    insert_conflictos = insert_dialecto()
+    if insert_conflictos is not None:
+        sentencia = insert_conflictos(Configuracion).values(filas)
+        sentencia = sentencia.on_conflict_do_update(
+            index_elements=['clave'],
+            set_={'valor': sentencia.excluded.valor, 'fecha_modificacion': sentencia.excluded.fecha_modificacion}
+        )
+        db.session.execute(sentencia)
+    else:
+        existentes = {
+            config.clave: config
+            for config in Configuracion.query.filter(Configuracion.clave.in_([f['clave'] for f in filas]))
+        }
+        for fila in filas:
+            config = existentes.get(fila['clave'])
+            if config:
+                config.valor = fila['valor']
+            else:
+                db.session.add(Configuracion(**fila))
+
+    db.session.commit()
+    versions.incrementar('configuracion')
@@ -0,0 +1,13 @@
+from extensions import db
+
+
+def insert_dialecto():
+    """Devuelve la función insert con soporte ON CONFLICT del motor actual, si existe"""
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    if dialecto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    return None
@@ -0,0 +1,62 @@
+"""Caché por worker de los usuarios autenticados.
+
+load_user se ejecuta en cada petición; aquí se guardan solo los campos que
+usan las vistas y los permisos. Una entrada vence a los USUARIOS_CACHE_TTL
+segundos, y toda la caché se descarta cuando cambia el sello 'usuarios'.
+"""
+from flask import current_app
+from flask_login import UserMixin
+from extensions import db
+from models import Usuario
+from services import versions
+import threading
+import time
+
+_lock = threading.Lock()
+_version = object()
+_usuarios = {}
+
+
+class UsuarioSesion(UserMixin):
+    """Datos del usuario de la sesión, sin vínculo con la sesión de SQLAlchemy"""
+    __slots__ = ('id', 'nombre', 'rol', 'activo')
+
+    def __init__(self, id, nombre, rol, activo):
+        self.id = id
+        self.nombre = nombre
+        self.rol = rol
+        self.activo = activo
+
+    @property
+    def is_active(self):
+        return self.activo
+
+
+def cargar(usuario_id):
+    """Usuario activo por id, o None si no existe o está desactivado"""
+    version = versions.actual('usuarios')
+    ahora = time.monotonic()
+    with _lock:
+        global _version
+        if version != _version:
+            _usuarios.clear()
+            _version = version
+        entrada = _usuarios.get(usuario_id)
+    if entrada is not None and entrada[0] > ahora:
+        return entrada[1]
+
+    fila = db.session.query(
+        Usuario.id, Usuario.nombre, Usuario.rol, Usuario.activo
+    ).filter(Usuario.id == usuario_id).first()
+    usuario = UsuarioSesion(fila.id, fila.nombre, fila.rol, bool(fila.activo)) if fila and fila.activo else None
+
+    vigencia = current_app.config.get('USUARIOS_CACHE_TTL', 60)
+    with _lock:
+        if _version == version:
+            _usuarios[usuario_id] = (ahora + vigencia, usuario)
+    return usuario
+
+
+def invalidar():
+    """Llamar después del commit de cualquier cambio en usuarios"""
+    versions.incrementar('usuarios')
@@ -0,0 +1,38 @@
+"""Sellos de versión compartidos entre los workers de gunicorn.
+
+Cada sello es un archivo en CACHE_DIR/versiones que se reemplaza al
+incrementarlo. Leer la versión cuesta un stat(), sin tocar la base de datos.
+"""
+from flask import current_app
+import os
+import tempfile
+
+
+def _ruta(nombre):
+    return os.path.join(current_app.config['CACHE_DIR'], 'versiones', nombre)
+
+
+def actual(nombre):
+    """Devuelve un valor que cambia cada vez que se incrementa el sello"""
+    try:
+        info = os.stat(_ruta(nombre))
+    except FileNotFoundError:
+        return None
+    return (info.st_ino, info.st_mtime_ns)
+
+
+def incrementar(nombre):
+    """Invalida el sello para todos los workers"""
+    ruta = _ruta(nombre)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    try:
+        with open(ruta) as archivo:
+            contador = int(archivo.read() or 0)
+    except (FileNotFoundError, ValueError):
+        contador = 0
+
+    # Escribir y reemplazar de forma atómica: el inodo nuevo cambia el sello
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta))
+    with os.fdopen(descriptor, 'w') as archivo:
+        archivo.write(str(contador + 1))
+    os.replace(temporal, ruta)
@@ -0,0 +1,37 @@
+// Contadores del día en vivo: escucha el stream de eventos del servidor y,
+// si el servidor no lo ofrece (workers sin hilos), consulta cada 30 segundos
+function iniciarEnVivo(urlStream, urlEstado, actualizar) {
+    let sondeo = null;
+
+    function sondear() {
+        if (sondeo) {
+            return;
+        }
+        sondeo = setInterval(() => {
+            fetch(urlEstado)
+                .then(response => response.ok ? response.json() : null)
+                .then(datos => datos && actualizar(datos))
+                .catch(() => {});
+        }, 30000);
+    }
+
+    if (!window.EventSource) {
+        sondear();
+        return;
+    }
+    const fuente = new EventSource(urlStream);
+    fuente.addEventListener('contadores', evento => actualizar(JSON.parse(evento.data)));
+    fuente.onerror = () => {
+        // Un 503 cierra la conexión sin reintentos; los cortes normales reconectan solos
+        if (fuente.readyState === EventSource.CLOSED) {
+            sondear();
+        }
+    };
+}
+
+function fijarTexto(id, valor) {
+    const elemento = document.getElementById(id);
+    if (elemento) {
+        elemento.textContent = valor;
+    }
+}